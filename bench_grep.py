@@ -0,0 +1,57 @@
+"""
+Бенчмарк regex grep: TextStore.grep_regex в текущем процессе против пула процессов
+Полный проход (запрос без совпадений) и ранний выход (max_lines=15) для 1, 2, 4, ...
+процессов до числа ядер - задержка полного прохода должна падать примерно с числом ядер
+
+Использование: python bench_grep.py [путь_к_тексту] [regex]
+"""
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from rag_text_store import get_text_store
+
+project_dir = Path(__file__).parent
+TEXT_FILE = sys.argv[1] if len(sys.argv) > 1 else str(project_dir / "cosmic_texts.txt")
+QUERY = sys.argv[2] if len(sys.argv) > 2 else r"нетакого\s*слова"
+EARLY_QUERY = "перун"
+REPEATS = 3
+
+
+def median_ms(func, repeats=REPEATS):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def main():
+    store = get_text_store(TEXT_FILE)
+    pattern = re.compile(QUERY, re.IGNORECASE)
+    early_pattern = re.compile(EARLY_QUERY, re.IGNORECASE)
+    cpu_count = os.cpu_count() or 1
+    worker_counts = [0] + [n for n in (2, 4, 8, 16, 32) if n <= cpu_count]
+
+    print("=" * 70)
+    print(f"GREP BENCHMARK: {TEXT_FILE}")
+    print(f"Size: {store.size / 1024 / 1024:.0f} MB, lines: {len(store)}, CPU: {cpu_count}")
+    print("=" * 70)
+
+    expected = store.grep_regex(pattern, workers=0)
+    print(f"{'workers':>8} {'full scan, ms':>15} {'max_lines=15, ms':>18} {'same':>6}")
+    for workers in worker_counts:
+        store.grep_regex(pattern, max_lines=1, workers=workers)  # запуск процессов пула
+        full_ms = median_ms(lambda: store.grep_regex(pattern, workers=workers))
+        early_ms = median_ms(lambda: store.grep_regex(early_pattern, max_lines=15, workers=workers))
+        same = store.grep_regex(pattern, workers=workers) == expected
+        print(f"{workers or 1:>8} {full_ms:>15.1f} {early_ms:>18.1f} {str(same):>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Бенчмарк MMR: rag_retrieval.mmr_select против LangChain maximal_marginal_relevance
+Случайные нормированные векторы (d = 1024, как у multilingual-e5-large),
+k = fetch_k // 3, lambda_mult = 0.5 - проверяется совпадение выбора и время
+"""
+import time
+
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+from rag_retrieval import mmr_select
+
+DIM = 1024
+FETCH_KS = (50, 150, 500)
+LAMBDA_MULT = 0.5
+REPEATS = 20
+SEED = 42
+
+
+def median_ms(func, repeats=REPEATS):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+rng = np.random.default_rng(SEED)
+
+print("=" * 70)
+print(f"MMR BENCHMARK (d={DIM}, lambda={LAMBDA_MULT}, median of {REPEATS})")
+print("=" * 70)
+print(f"{'fetch_k':>8} {'k':>5} {'LangChain, ms':>15} {'mmr_select, ms':>15} {'speedup':>9} {'same':>6}")
+
+for fetch_k in FETCH_KS:
+    k = fetch_k // 3
+    query = rng.standard_normal(DIM).astype(np.float32)
+    candidates = rng.standard_normal((fetch_k, DIM)).astype(np.float32)
+    candidates /= np.linalg.norm(candidates, axis=1, keepdims=True)
+    # Векторы в том виде, в каком их отдаёт ChromaDB (список строк)
+    candidate_list = list(candidates)
+
+    expected = maximal_marginal_relevance(query, candidate_list, k=k, lambda_mult=LAMBDA_MULT)
+    actual = mmr_select(query, candidate_list, k=k, lambda_mult=LAMBDA_MULT)
+
+    langchain_ms = median_ms(lambda: maximal_marginal_relevance(query, candidate_list, k=k, lambda_mult=LAMBDA_MULT))
+    fast_ms = median_ms(lambda: mmr_select(query, candidate_list, k=k, lambda_mult=LAMBDA_MULT))
+
+    print(f"{fetch_k:>8} {k:>5} {langchain_ms:>15.2f} {fast_ms:>15.2f} "
+          f"{langchain_ms / fast_ms:>8.1f}x {str(expected == actual):>6}")
@@ -8,6 +8,7 @@ import sys
 # Настройки
 project_dir = Path(__file__).parent
 TEXT_FILE = str(project_dir / "cosmic_texts.txt")
+EMBEDDING_CACHE_DIR = str(project_dir / "embedding_cache")
 DB_PATH = str(project_dir / "chroma_db_labse")  # Новая база с LaBSE
 
 print("="*70)
@@ -26,19 +27,20 @@ rag = LocalRAG(
     text_file_path=TEXT_FILE,
     db_path=DB_PATH,
     embedding_model="sentence-transformers/LaBSE",  # ЛУЧШАЯ МОДЕЛЬ ДЛЯ РУССКОГО
-    use_gpu=True
+    use_gpu=True,
+    embedding_cache_dir=EMBEDDING_CACHE_DIR  # общий кэш векторов для всех баз
 )
 
 # Загрузка и разбиение документов
 print("\n[2/4] Загрузка и разбиение документов...")
-documents = rag.load_and_split_documents(
+documents = rag.iter_split_documents(  # генератор: файл читается окнами
     chunk_size=500,  # ОПТИМАЛЬНО для поиска коротких терминов
     chunk_overlap=100
 )
 
 # Создание векторного хранилища
 print("\n[3/4] Создание векторной базы данных (это займет несколько минут)...")
-vectorstore = rag.create_vectorstore(documents, force_recreate=True)
+vectorstore = rag.sync_vectorstore(documents)  # только новые/изменённые чанки
 
 # Создание retriever
 print("\n[4/4] Настройка retriever с MMR...")
@@ -48,7 +50,7 @@ print("\n" + "="*70)
 print("БАЗА ДАННЫХ СОЗДАНА УСПЕШНО!")
 print("="*70)
 print(f"Путь: {DB_PATH}")
-print(f"Документов: {len(documents)}")
+print(f"Документов: {vectorstore._collection.count()}")
 print(f"Chunk size: 500")
 print(f"MMR: Enabled")
 print()
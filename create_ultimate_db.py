@@ -3,86 +3,116 @@
 intfloat/multilingual-e5-large - лучшая для русского языка
 """
 from rag_knowledge_base import LocalRAG
+from rag_text_store import get_text_store
 from pathlib import Path
 import sys
 
 # Настройки
 project_dir = Path(__file__).parent
 TEXT_FILE = str(project_dir / "cosmic_texts.txt")
+EMBEDDING_CACHE_DIR = str(project_dir / "embedding_cache")
 DB_PATH = str(project_dir / "chroma_db_ultimate")  # Новая ULTIMATE база
 
-print("="*70)
-print("CREATING ULTIMATE DATABASE")
-print("="*70)
-print(f"Embedding model: intfloat/multilingual-e5-large")
-print(f"  [+] Best for Russian language")
-print(f"  [+] Size: 2.2 GB")
-print(f"  [+] Quality: maximum")
-print()
-print(f"Text file: {TEXT_FILE}")
-print(f"Database: {DB_PATH}")
-print()
-
-# Sozdanie RAG
-print("[1/4] Loading embedding model (few minutes)...")
-print("      Downloading 2.2 GB model...")
-
-rag = LocalRAG(
-    text_file_path=TEXT_FILE,
-    db_path=DB_PATH,
-    embedding_model="intfloat/multilingual-e5-large",  # BEST MODEL
-    use_gpu=True
-)
-
-print("      [+] Model loaded!")
-
-# Zagruzka i razbienie dokumentov
-print("\n[2/4] Loading and splitting documents...")
-documents = rag.load_and_split_documents(
-    chunk_size=500,  # OPTIMAL for short terms search
-    chunk_overlap=100
-)
-
-# Sozdanie vektornogo hranilishcha
-print("\n[3/4] Creating vector database (10-15 minutes)...")
-print("      Processing 142,072 documents with GPU...")
-vectorstore = rag.create_vectorstore(documents, force_recreate=True)
-
-# Sozdanie retriever
-print("\n[4/4] Setting up retriever with MMR...")
-rag.create_qa_chain(retriever_k=10, use_mmr=True)
-
-print("\n" + "="*70)
-print("DATABASE CREATED SUCCESSFULLY!")
-print("="*70)
-print(f"Path: {DB_PATH}")
-print(f"Documents: {len(documents)}")
-print(f"Chunk size: 500")
-print(f"MMR: Enabled")
-print(f"Embedding: intfloat/multilingual-e5-large (BEST)")
-print()
-
-# Test poiska
-print("\n" + "="*70)
-print("VECTOR SEARCH TEST")
-print("="*70)
-
-test_terms = ["Perun", "Firast", "Pirva"]
-
-for term in test_terms:
-    print(f"\nSearch: '{term}'")
-    docs = rag.retriever.invoke(term)
-
-    found = sum(1 for doc in docs[:5] if term in doc.page_content or term.lower() in doc.page_content.lower())
-
-    if found > 0:
-        print(f"  [+] Found {found}/5 documents with '{term}'")
-    else:
-        print(f"  [-] Not found documents with '{term}'")
-
-print("\n" + "="*70)
-print("ULTIMATE DATABASE READY!")
-print("="*70)
-print("\nUse it in web interface:")
-print("  python rag_web_modern.py")
-print()
+# Сборка на CPU-сервере: N процессов со своей копией модели (0 - один процесс / GPU)
+EMBEDDING_WORKERS = 0
+# Бэкенд модели: "torch" (fp32) или "onnx"/"onnx-int8"/"int8" на CPU
+EMBEDDING_BACKEND = "torch"
+# HNSW (только при создании базы; None - по умолчанию ChromaDB: M=16, ef_construction=100, ef_search=100)
+# Рабочие точки подбираются hnsw_sweep.py по recall относительно точного поиска
+HNSW_M = None
+HNSW_EF_CONSTRUCTION = None
+HNSW_EF_SEARCH = None
+
+
+def main():
+    print("="*70)
+    print("CREATING ULTIMATE DATABASE")
+    print("="*70)
+    print(f"Embedding model: intfloat/multilingual-e5-large")
+    print(f"  [+] Best for Russian language")
+    print(f"  [+] Size: 2.2 GB")
+    print(f"  [+] Quality: maximum")
+    print()
+    print(f"Text file: {TEXT_FILE}")
+    print(f"Database: {DB_PATH}")
+    print()
+
+    # Sozdanie RAG
+    print("[1/4] Loading embedding model (few minutes)...")
+    print("      Downloading 2.2 GB model...")
+
+    rag = LocalRAG(
+        text_file_path=TEXT_FILE,
+        db_path=DB_PATH,
+        embedding_model="intfloat/multilingual-e5-large",  # BEST MODEL
+        use_gpu=True,
+        embedding_cache_dir=EMBEDDING_CACHE_DIR,  # общий кэш векторов для всех баз
+        embed_batch_size=32,   # батчи по бюджету токенов: 32 x 512
+        max_seq_length=512,    # e5-large: чанк 500 символов ≈ 150-250 токенов
+        embedding_workers=EMBEDDING_WORKERS,
+        embedding_backend=EMBEDDING_BACKEND,
+        hnsw_m=HNSW_M,
+        hnsw_ef_construction=HNSW_EF_CONSTRUCTION,
+        hnsw_ef_search=HNSW_EF_SEARCH
+    )
+
+    print("      [+] Model loaded!")
+
+    # Zagruzka i razbienie dokumentov
+    print("\n[2/4] Streaming documents (chunks go straight to embedding)...")
+    documents = rag.iter_split_documents(  # генератор: файл читается окнами
+        chunk_size=500,  # OPTIMAL for short terms search
+        chunk_overlap=100
+    )
+
+    # Sozdanie vektornogo hranilishcha
+    print("\n[3/4] Syncing vector database (full build 10-15 minutes, re-run: only changed chunks)...")
+    print("      Processing 142,072 documents with GPU...")
+    vectorstore = rag.sync_vectorstore(documents)  # только новые/изменённые чанки
+    rag.embeddings.close()  # останавливаем процессы пула (если были)
+    print("      Text indexes for grep (lines, folded, shadow)...")
+    get_text_store(TEXT_FILE).build_indexes()
+
+    # Sozdanie retriever
+    print("\n[4/4] Setting up retriever with MMR...")
+    rag.create_qa_chain(retriever_k=10, use_mmr=True)
+
+    print("\n" + "="*70)
+    print("DATABASE CREATED SUCCESSFULLY!")
+    print("="*70)
+    print(f"Path: {DB_PATH}")
+    print(f"Documents: {vectorstore._collection.count()}")
+    print(f"Chunk size: 500")
+    print(f"MMR: Enabled")
+    print(f"Embedding: intfloat/multilingual-e5-large (BEST)")
+    print()
+
+    # Test poiska
+    print("\n" + "="*70)
+    print("VECTOR SEARCH TEST")
+    print("="*70)
+
+    test_terms = ["Perun", "Firast", "Pirva"]
+
+    for term in test_terms:
+        print(f"\nSearch: '{term}'")
+        docs = rag.retriever.invoke(term)
+
+        found = sum(1 for doc in docs[:5] if term in doc.page_content or term.lower() in doc.page_content.lower())
+
+        if found > 0:
+            print(f"  [+] Found {found}/5 documents with '{term}'")
+        else:
+            print(f"  [-] Not found documents with '{term}'")
+
+    print("\n" + "="*70)
+    print("ULTIMATE DATABASE READY!")
+    print("="*70)
+    print("\nUse it in web interface:")
+    print("  python rag_web_modern.py")
+    print()
+
+
+if __name__ == "__main__":
+    # Защита обязательна: процессы пула (spawn) импортируют этот модуль заново
+    main()
@@ -0,0 +1,88 @@
+"""
+Recall vs latency HNSW поиска ChromaDB относительно точного перебора
+Для каждого ef_search: recall@k (доля точного top-k, найденная HNSW) и
+медианная задержка запроса - по ним выбираются рабочие точки эндпоинтов
+(SEMANTIC_EF_SEARCH в лаунчерах, ef_search у vector_search/fused_search)
+
+Запросы - векторы случайных чанков самой базы (сам чанк из выдачи исключается),
+модель эмбеддингов не загружается.
+
+Использование: python hnsw_sweep.py [путь_к_базе] [k]
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from rag_chroma import DEFAULT_EF_SEARCH, collection_hnsw, get_collection, query_collection
+from rag_exact_search import ExactIndex
+
+project_dir = Path(__file__).parent
+DB_PATH = sys.argv[1] if len(sys.argv) > 1 else str(project_dir / "chroma_db_ultimate")
+K = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+EF_VALUES = (10, 25, 50, 100, 150, 200, 400, 800)
+NUM_QUERIES = 100
+SEED = 42
+
+
+def run_sweep(collection, exact_index, query_ids, query_vectors, k, ef_values):
+    """[(ef, recall@k, медиана мс)] по ef_values"""
+    truth = []
+    for query_id, ranking in zip(query_ids, exact_index.search_batch(query_vectors, k + 1)):
+        truth.append({chunk_id for chunk_id, _ in ranking if chunk_id != query_id})
+
+    base_ef = collection_hnsw(collection).get('ef_search', DEFAULT_EF_SEARCH)
+    rows = []
+    # Фактический ef = max(ef_search коллекции, запрошенный, n_results): меньшие значения совпадают
+    for ef in sorted({max(ef, base_ef, k + 1) for ef in ef_values}):
+        recalls, timings = [], []
+        for query_id, vector, expected in zip(query_ids, query_vectors, truth):
+            start = time.perf_counter()
+            result = query_collection(collection, [vector.tolist()], k + 1, ef_search=ef, include=[])
+            timings.append((time.perf_counter() - start) * 1000)
+            found = [chunk_id for chunk_id in result['ids'][0] if chunk_id != query_id][:k]
+            recalls.append(len(expected.intersection(found)) / max(1, len(expected)))
+        rows.append((ef, float(np.mean(recalls)), float(np.median(timings))))
+    return rows
+
+
+def main():
+    collection = get_collection(DB_PATH)
+    count = collection.count()
+    if count == 0:
+        print(f"Database is empty: {DB_PATH}")
+        sys.exit(1)
+
+    exact_index = ExactIndex.load(DB_PATH)
+    if exact_index is None or len(exact_index) != count:
+        print("Building exact index...")
+        exact_index = ExactIndex.build(collection, DB_PATH)
+
+    rng = np.random.default_rng(SEED)
+    rows = rng.choice(len(exact_index), size=min(NUM_QUERIES, len(exact_index)), replace=False)
+    query_ids = [str(exact_index.ids[row]) for row in rows]
+    query_vectors = exact_index.vectors(rows)
+
+    hnsw = collection_hnsw(collection)
+    print("=" * 70)
+    print(f"HNSW SWEEP: {DB_PATH}")
+    print(f"Chunks: {count}, k={K}, queries={len(query_ids)}")
+    print(f"Collection: M={hnsw.get('max_neighbors')}, ef_construction={hnsw.get('ef_construction')}, "
+          f"ef_search={hnsw.get('ef_search', DEFAULT_EF_SEARCH)}")
+    print("=" * 70)
+
+    exact_ms = []
+    for vector in query_vectors:
+        start = time.perf_counter()
+        exact_index.search(vector, K + 1)
+        exact_ms.append((time.perf_counter() - start) * 1000)
+
+    print(f"{'ef_search':>10} {'recall@' + str(K):>10} {'median, ms':>12}")
+    for ef, recall, median_ms in run_sweep(collection, exact_index, query_ids, query_vectors, K, EF_VALUES):
+        print(f"{ef:>10} {recall:>10.3f} {median_ms:>12.2f}")
+    print(f"{'exact':>10} {1.0:>10.3f} {float(np.median(exact_ms)):>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -56,18 +56,19 @@ class AdvancedRAGMemory(LocalRAG):
             # Приблизительно: 1 токен ≈ 4 символа для русского
             return len(text) // 4
 
-    def hybrid_search(self, query: str, k: int = 10, keyword_boost: float = 4.0):
+    def hybrid_search(self, query: str, k: int = 10, fusion: str = "rrf", keyword_weight: float = 1.0):
         """
-        Гибридный поиск: векторный + keyword фильтрация
+        Гибридный поиск: векторный + keyword (BM25) со слиянием по скорам
 
-        1. Векторный поиск (MMR) - находит семантически похожие документы
-        2. Keyword фильтрация - проверяет наличие ключевых слов из запроса
-        3. Бустинг - повышает ранг документов с точным совпадением
+        1. Векторный поиск - top-2k по косинусной близости
+        2. Keyword поиск - top-2k по BM25 для значимых слов запроса
+        3. Слияние (RRF или взвешенная сумма) - top-k
 
         Args:
             query: поисковый запрос
             k: количество документов
-            keyword_boost: коэффициент усиления для документов с точным совпадением
+            fusion: "rrf" (по рангам) или "weighted" (по нормированным скорам)
+            keyword_weight: вес keyword результатов относительно векторных
         """
         # Извлекаем ЗНАЧИМЫЕ СЛОВА (русские слова >=4 символа)
         # ИСКЛЮЧАЕМ служебные слова и короткие предлоги
@@ -77,44 +78,20 @@ class AdvancedRAGMemory(LocalRAG):
         words = re.findall(r'\b[а-яёА-ЯЁ]{4,}\b', query.lower())
         keywords = [w.capitalize() for w in words if w not in stopwords]
 
-        # 1. ВЕКТОРНЫЙ ПОИСК (MMR) - всегда используем, так как ChromaDB direct search слишком медленный
-        # Увеличиваем k для лучшего охвата при наличии ключевых слов
-        if keywords:
-            # Больше документов для keyword фильтрации
-            vector_docs = self.vectorstore.max_marginal_relevance_search(
-                query, k=k * 5, fetch_k=k * 15, lambda_mult=0.3
+        # Векторные и BM25 кандидаты (по 2k) сливаются по настоящим скорам,
+        # без перевыборки k*5 / fetch_k=k*15 через MMR
+        def search():
+            results = self.fused_search(
+                query,
+                k=k,
+                keywords=keywords,
+                fusion=fusion,
+                keyword_weight=keyword_weight
             )
-        else:
-            # Обычный векторный поиск
-            vector_docs = self.vectorstore.max_marginal_relevance_search(
-                query, k=k * 3, fetch_k=k * 9, lambda_mult=0.5
-            )
-
-        # 2. Keyword фильтрация и ранжирование
-        scored_docs = []
-        for doc in vector_docs:
-            content = doc.page_content
-            score = 1.0  # Базовый скор от векторного поиска
-
-            # Подсчет совпадений ключевых слов
-            matches = 0
-            for keyword in keywords:
-                if keyword in content or keyword.lower() in content.lower():
-                    matches += 1
-
-            # Бустинг документов с ключевыми словами
-            if matches > 0:
-                score = score * (keyword_boost ** matches)
+            return [doc for doc, _ in results]
 
-            scored_docs.append((score, doc, matches))
-
-        # Сортировка по скору
-        scored_docs.sort(key=lambda x: x[0], reverse=True)
-
-        # Возврат топ-k документов
-        result_docs = [doc for _, doc, _ in scored_docs[:k]]
-
-        return result_docs
+        # Повторный вопрос к той же версии базы - из кэша результатов
+        return self.cached_result("hybrid_search", query, (k, fusion, keyword_weight), search)
 
     def _summarize_old_messages(self) -> str:
         """Суммаризация старых сообщений"""
@@ -348,7 +325,9 @@ class AdvancedRAGMemory(LocalRAG):
             "total_questions": len(self.short_memory) + sum(1 for _ in self.long_memory),
             "auto_summarize_enabled": self.enable_auto_summarize,
             "max_context_tokens": self.max_context_tokens,
-            "summarize_threshold": self.summarize_threshold
+            "summarize_threshold": self.summarize_threshold,
+            "query_cache": self.query_cache.stats() if self.query_cache is not None else None,
+            "result_cache": self.result_cache.stats() if self.result_cache is not None else None
         }
 
     def export_conversation(self, filepath: str):
@@ -402,12 +381,8 @@ if __name__ == "__main__":
     )
 
     # Загрузка существующей БД
-    from langchain_community.vectorstores import Chroma
     print("\n📚 Загрузка векторной базы данных...")
-    rag.vectorstore = Chroma(
-        persist_directory=DB_PATH,
-        embedding_function=rag.embeddings
-    )
+    rag.load_vectorstore()
 
     print("🔗 Подключение к LM Studio...")
     rag.setup_lm_studio_llm(model_name="google/gemma-3-27b")
@@ -0,0 +1,241 @@
+"""
+Общий для процесса реестр ChromaDB клиентов и коллекций
+Одна база (папка chroma_db_*) открывается один раз: LangChain vectorstore,
+keyword поиск и служебные запросы работают с одним и тем же объектом коллекции
+
+Параметры HNSW: M и ef_construction задаются при создании коллекции, ef_search -
+тоже, но загруженный индекс его не перечитывает (collection.modify действует только
+после перезапуска процесса). hnswlib ищет с ef = max(ef_search, n_results), поэтому
+усилие поиска на запрос поднимается запросом n_results = ef_search с обрезкой до k.
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import chromadb
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+
+from rag_retrieval import mmr_select
+
+# Имя коллекции LangChain Chroma по умолчанию - так называются все наши базы
+COLLECTION_NAME = "langchain"
+
+# Значение ChromaDB по умолчанию для коллекций, созданных без настроек HNSW
+DEFAULT_EF_SEARCH = 100
+
+_lock = threading.Lock()
+_clients: Dict[str, object] = {}
+_collections: Dict[Tuple[str, str], object] = {}
+
+
+def _db_key(db_path: str) -> str:
+    return os.path.realpath(db_path)
+
+
+def get_client(db_path: str):
+    """PersistentClient базы (создаётся один раз на путь)"""
+    key = _db_key(db_path)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = chromadb.PersistentClient(path=key)
+        return client
+
+
+def hnsw_configuration(max_neighbors: Optional[int] = None, ef_construction: Optional[int] = None,
+                       ef_search: Optional[int] = None) -> Optional[dict]:
+    """
+    Настройки HNSW для создания коллекции (None - значения ChromaDB по умолчанию)
+
+    Args:
+        max_neighbors: M - связей на узел графа (больше - выше recall, больше памяти)
+        ef_construction: ширина поиска при вставке (больше - качественнее граф, медленнее сборка)
+        ef_search: ширина поиска при запросе (больше - выше recall, медленнее запрос)
+    """
+    params = {'max_neighbors': max_neighbors, 'ef_construction': ef_construction, 'ef_search': ef_search}
+    hnsw = {key: value for key, value in params.items() if value is not None}
+    return {'hnsw': hnsw} if hnsw else None
+
+
+def collection_hnsw(collection) -> dict:
+    """Фактические настройки HNSW коллекции (пусто, если ChromaDB их не сообщает)"""
+    configuration = getattr(collection, 'configuration', None) or {}
+    return dict(configuration.get('hnsw') or {})
+
+
+def query_collection(collection, query_embeddings, n_results: int, ef_search: Optional[int] = None,
+                     **kwargs) -> dict:
+    """
+    collection.query с усилием поиска на запрос
+
+    ef_search больше настроенного в коллекции: запрашивается n_results = ef_search
+    (hnswlib ищет с ef = max(ef, n_results)), результаты обрезаются до n_results.
+    """
+    fetch = max(n_results, ef_search or 0)
+    results = collection.query(query_embeddings=query_embeddings, n_results=fetch, **kwargs)
+    if fetch > n_results:
+        # Строки - списки (ids, documents, ...) или numpy массивы (embeddings)
+        for key, value in results.items():
+            if isinstance(value, list) and value and hasattr(value[0], '__getitem__') \
+                    and not isinstance(value[0], (str, dict)):
+                results[key] = [row[:n_results] for row in value]
+    return results
+
+
+def get_collection(db_path: str, name: str = COLLECTION_NAME, metadata: Optional[dict] = None,
+                   configuration: Optional[dict] = None):
+    """
+    Коллекция базы (открывается один раз на путь и имя)
+
+    configuration (см. hnsw_configuration) применяется только при создании коллекции.
+    """
+    key = (_db_key(db_path), name)
+    with _lock:
+        collection = _collections.get(key)
+    if collection is None:
+        collection = get_client(db_path).get_or_create_collection(
+            name=name, metadata=metadata, configuration=configuration
+        )
+        with _lock:
+            collection = _collections.setdefault(key, collection)
+    return collection
+
+
+def forget_collection(db_path: str, name: str = COLLECTION_NAME):
+    """Убрать коллекцию из реестра (после delete_collection - следующий вызов откроет новую)"""
+    with _lock:
+        _collections.pop((_db_key(db_path), name), None)
+
+
+class FastMMRChroma(Chroma):
+    """
+    Chroma с векторизованным MMR (rag_retrieval.mmr_select)
+
+    Все MMR пути (retriever search_type="mmr", max_marginal_relevance_search)
+    идут сюда: векторы кандидатов берутся из того же ответа ChromaDB, что и
+    документы, без повторного запроса и повторной векторизации.
+
+    Если задан exact_index (rag_exact_search.ExactIndex), кандидаты MMR и
+    similarity_search считаются точным перебором вместо HNSW (запросы с
+    filter/where_document по-прежнему идут в ChromaDB).
+
+    search_kwargs ретривера принимают ef_search - усилие HNSW поиска на запрос
+    (см. query_collection).
+    """
+
+    exact_index = None
+
+    def _documents_by_ids(self, ids: List[str]) -> List[Document]:
+        """Документы коллекции в порядке ids"""
+        result = self._collection.get(ids=list(ids), include=["metadatas", "documents"])
+        by_id = {
+            chunk_id: Document(id=chunk_id, page_content=text, metadata=meta or {})
+            for chunk_id, text, meta in zip(result["ids"], result["documents"], result["metadatas"])
+        }
+        return [by_id[chunk_id] for chunk_id in ids if chunk_id in by_id]
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict[str, str]] = None,
+        ef_search: Optional[int] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        where_document = kwargs.pop("where_document", None)
+        embedding = self._embedding_function.embed_query(query)
+        if self.exact_index is not None and not filter and not where_document:
+            hits = self.exact_index.search(embedding, k)
+            return self._documents_by_ids([chunk_id for chunk_id, _ in hits])
+
+        results = query_collection(
+            self._collection, [embedding], k, ef_search=ef_search,
+            where=filter, where_document=where_document,
+            include=["metadatas", "documents"]
+        )
+        return [
+            Document(id=chunk_id, page_content=text, metadata=meta or {})
+            for chunk_id, text, meta in zip(results["ids"][0], results["documents"][0], results["metadatas"][0])
+        ]
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: Optional[Dict[str, str]] = None,
+        where_document: Optional[Dict[str, str]] = None,
+        ef_search: Optional[int] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        # Chroma.max_marginal_relevance_search не передаёт **kwargs дальше - ef_search терялся
+        embedding = self._embedding_function.embed_query(query)
+        return self.max_marginal_relevance_search_by_vector(
+            embedding, k, fetch_k, lambda_mult=lambda_mult,
+            filter=filter, where_document=where_document, ef_search=ef_search
+        )
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: Optional[Dict[str, str]] = None,
+        where_document: Optional[Dict[str, str]] = None,
+        ef_search: Optional[int] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        if self.exact_index is not None and not filter and not where_document:
+            rows = self.exact_index.search_rows([embedding], fetch_k)[0][0]
+            if not len(rows):
+                return []
+            selected = mmr_select(embedding, self.exact_index.vectors(rows), k=k, lambda_mult=lambda_mult)
+            return self._documents_by_ids([str(self.exact_index.ids[rows[i]]) for i in sorted(selected)])
+
+        results = query_collection(
+            self._collection,
+            [embedding],
+            fetch_k,
+            ef_search=ef_search,
+            where=filter,
+            where_document=where_document,
+            include=["metadatas", "documents", "embeddings"],
+            **kwargs,
+        )
+        ids = results["ids"][0]
+        if not ids:
+            return []
+
+        selected = mmr_select(embedding, results["embeddings"][0], k=k, lambda_mult=lambda_mult)
+
+        # Порядок кандидатов (по близости к запросу), как у LangChain
+        return [
+            Document(id=ids[i], page_content=results["documents"][0][i], metadata=results["metadatas"][0][i] or {})
+            for i in sorted(selected)
+        ]
+
+
+def open_vectorstore(db_path: str, embeddings, name: str = COLLECTION_NAME,
+                     collection_metadata: Optional[dict] = None,
+                     configuration: Optional[dict] = None) -> Chroma:
+    """
+    LangChain Chroma (с быстрым MMR) поверх общего клиента и общей коллекции
+
+    Замена Chroma(persist_directory=...): повторное открытие той же базы
+    не создаёт новый клиент и не перечитывает SQLite/HNSW сегменты.
+    """
+    # Коллекция создаётся через реестр до LangChain: иначе Chroma() создаст её без configuration
+    collection = get_collection(db_path, name, collection_metadata, configuration)
+    vectorstore = FastMMRChroma(
+        client=get_client(db_path),
+        collection_name=name,
+        embedding_function=embeddings,
+        collection_metadata=collection_metadata
+    )
+    # Тот же объект коллекции, что и у keyword/служебных путей
+    vectorstore._collection = collection
+    return vectorstore
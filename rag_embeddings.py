@@ -0,0 +1,766 @@
+"""
+Обёртки над embedding моделью для RAG
+- Дисковый кэш векторов - один и тот же текст одной моделью не векторизуется дважды
+- Батчи по длине в токенах - меньше паддинга внутри батча трансформера
+- Пул процессов для сборки базы на CPU (своя копия модели в каждом процессе)
+- Бэкенды инференса для CPU: ONNX Runtime и int8 квантизация с проверкой близости к fp32
+- Выбор устройства, потоки torch и ограничение параллельных запросов к модели
+- LRU кэш векторов запросов, общий для всех инструментов поиска в процессе
+"""
+
+import hashlib
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingsWrapper(Embeddings):
+    """Базовая обёртка: всё, что не переопределено, делегируется внутренней модели"""
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def embed_batches(self, batches: Iterable[List[str]]) -> Iterator[List[List[float]]]:
+        """Векторизация потока батчей (порядок сохраняется)"""
+        for texts in batches:
+            yield self.embed_documents(texts) if texts else []
+
+    def close(self):
+        """Освобождение ресурсов внутренней модели (пул процессов и т.п.)"""
+        close = getattr(self.embeddings, 'close', None)
+        if close is not None:
+            close()
+
+
+def embed_batches(embeddings: Embeddings, batches: Iterable[List[str]]) -> Iterator[List[List[float]]]:
+    """Потоковая векторизация для любой модели: обёртки умеют стримить, обычная модель - по батчу"""
+    if hasattr(embeddings, 'embed_batches'):
+        yield from embeddings.embed_batches(batches)
+        return
+    for texts in batches:
+        yield embeddings.embed_documents(texts) if texts else []
+
+
+def length_bucketed_batches(lengths: Sequence[int], batch_size: int, max_seq_length: int) -> List[List[int]]:
+    """
+    Разбиение на батчи по бюджету токенов
+
+    Тексты сортируются по длине в токенах, батч набирается, пока
+    (кол-во текстов) x (самый длинный текст батча) <= batch_size x max_seq_length.
+    Короткие чанки идут большими батчами, длинные - маленькими, паддинга почти нет.
+
+    Returns:
+        список батчей, каждый батч - список индексов исходных текстов
+    """
+    token_budget = batch_size * max_seq_length
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+
+    batches = []
+    current = []
+    for i in order:
+        # Порядок возрастающий - текущий текст самый длинный в батче
+        padded_len = min(lengths[i], max_seq_length)
+        if current and padded_len * (len(current) + 1) > token_budget:
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def encode_length_bucketed(model, texts: List[str], batch_size: int, encode_kwargs: Optional[dict] = None) -> np.ndarray:
+    """
+    Векторизация SentenceTransformer батчами по длине с восстановлением порядка
+
+    Args:
+        model: sentence_transformers.SentenceTransformer
+        texts: тексты (порядок результата совпадает с порядком texts)
+        batch_size: эквивалентный размер батча из текстов максимальной длины
+        encode_kwargs: параметры model.encode (normalize_embeddings и т.п.)
+    """
+    encode_kwargs = {k: v for k, v in (encode_kwargs or {}).items() if k != 'batch_size'}
+    max_seq_length = model.max_seq_length
+
+    # Как в HuggingFaceEmbeddings.embed_documents
+    texts = [t.replace("\n", " ") for t in texts]
+
+    token_ids = model.tokenizer(texts, truncation=True, max_length=max_seq_length)['input_ids']
+    lengths = [len(ids) for ids in token_ids]
+
+    result = None
+    for batch in length_bucketed_batches(lengths, batch_size, max_seq_length):
+        vectors = model.encode(
+            [texts[i] for i in batch],
+            batch_size=len(batch),
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            **encode_kwargs
+        )
+        if result is None:
+            result = np.empty((len(texts), vectors.shape[1]), dtype=vectors.dtype)
+        result[batch] = vectors
+    return result
+
+
+class LengthBucketedEmbeddings(EmbeddingsWrapper):
+    """
+    Векторизация документов батчами по бюджету токенов (для ingestion)
+
+    Оборачивает HuggingFaceEmbeddings: запросы (embed_query) идут как раньше,
+    а embed_documents сортирует чанки по длине, собирает батчи по бюджету
+    токенов и восстанавливает исходный порядок векторов.
+    """
+
+    def __init__(self, embeddings, batch_size: int = 32, max_seq_length: Optional[int] = None):
+        super().__init__(embeddings)
+        self.model = embeddings.client  # SentenceTransformer
+        if max_seq_length:
+            self.model.max_seq_length = max_seq_length
+        self.batch_size = batch_size
+        self.encode_kwargs = dict(embeddings.encode_kwargs)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return encode_length_bucketed(self.model, texts, self.batch_size, self.encode_kwargs).tolist()
+
+
+def detect_device(prefer_gpu: bool = True) -> str:
+    """
+    Устройство для embedding модели: cuda → mps → cpu
+
+    use_gpu=True на машине без CUDA больше не падает - модель уходит на CPU.
+    """
+    if not prefer_gpu:
+        return 'cpu'
+    try:
+        import torch
+    except ImportError:
+        return 'cpu'
+
+    if torch.cuda.is_available():
+        return 'cuda'
+    mps = getattr(torch.backends, 'mps', None)
+    if mps is not None and mps.is_available():
+        return 'mps'
+    print("⚠️ CUDA недоступна, embeddings на CPU")
+    return 'cpu'
+
+
+def configure_torch_threads(intra_op: Optional[int] = None, inter_op: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Число потоков torch внутри операции (intra-op) и между операциями (inter-op)
+
+    inter-op задаётся один раз на процесс до первой параллельной работы,
+    повторная попытка только печатает предупреждение.
+
+    Returns:
+        (intra_op, inter_op) после настройки
+    """
+    import torch
+
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    if inter_op and inter_op != torch.get_num_interop_threads():
+        try:
+            torch.set_interop_threads(inter_op)
+        except RuntimeError:
+            print(f"⚠️ inter-op threads already fixed at {torch.get_num_interop_threads()}")
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+class ConcurrencyLimitedEmbeddings(EmbeddingsWrapper):
+    """
+    Не более max_concurrent одновременных вызовов модели
+
+    Каждый вызов torch и так занимает все intra-op потоки; несколько запросов
+    Gradio параллельно дают N x потоков на тех же ядрах и взаимную пробуксовку.
+    Лишние запросы ждут своей очереди (обычно это быстрее, чем делить ядра).
+    Потоковая векторизация (embed_batches) при сборке базы не ограничивается.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_concurrent: int = 1):
+        super().__init__(embeddings)
+        self.max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.waited = 0  # вызовов, которым пришлось ждать свободный слот
+
+    def _acquire(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waited += 1
+            self._slots.acquire()
+        with self._lock:
+            self.calls += 1
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._acquire()
+        try:
+            return self.embeddings.embed_documents(texts)
+        finally:
+            self._slots.release()
+
+    def embed_query(self, text: str) -> List[float]:
+        self._acquire()
+        try:
+            return self.embeddings.embed_query(text)
+        finally:
+            self._slots.release()
+
+    def embed_batches(self, batches: Iterable[List[str]]) -> Iterator[List[List[float]]]:
+        return embed_batches(self.embeddings, batches)
+
+    def stats(self) -> dict:
+        return {"max_concurrent": self.max_concurrent, "calls": self.calls, "waited": self.waited}
+
+
+def normalize_query(text: str) -> str:
+    """Ключ кэша запроса: NFC, пробелы схлопнуты, края обрезаны (регистр важен для модели)"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class QueryEmbeddingLRU:
+    """
+    Ограниченный LRU: (модель, нормализованный запрос) → вектор
+
+    Один экземпляр на процесс (get_query_embedding_cache): агент, повторяющий
+    rag_semantic_search, hybrid_search и ретривер с тем же вопросом, векторизует его один раз.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, str]) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return list(vector)
+
+    def put(self, key: Tuple[str, str], vector: List[float]):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = tuple(vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+_query_cache: Optional[QueryEmbeddingLRU] = None
+_query_cache_lock = threading.Lock()
+
+
+def get_query_embedding_cache(max_size: Optional[int] = None) -> QueryEmbeddingLRU:
+    """Общий для процесса кэш векторов запросов (max_size меняет лимит существующего)"""
+    global _query_cache
+    with _query_cache_lock:
+        if _query_cache is None:
+            _query_cache = QueryEmbeddingLRU(1024 if max_size is None else max_size)
+        elif max_size is not None:
+            _query_cache.max_size = max_size
+        return _query_cache
+
+
+class CachedQueryEmbeddings(EmbeddingsWrapper):
+    """
+    embed_query через общий LRU кэш запросов; документы идут в модель как есть
+
+    model_key (embedding_model_key) различает модели и бэкенды (векторы onnx-int8 и torch не смешиваются).
+    Стоит снаружи ConcurrencyLimitedEmbeddings: попадание в кэш не ждёт очереди к модели.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_key: str, cache: Optional[QueryEmbeddingLRU] = None):
+        super().__init__(embeddings)
+        self.model_key = model_key
+        self.cache = cache if cache is not None else get_query_embedding_cache()
+
+    def embed_query(self, text: str) -> List[float]:
+        key = (self.model_key, normalize_query(text))
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(key, vector)
+        return vector
+
+    def embed_batches(self, batches: Iterable[List[str]]) -> Iterator[List[List[float]]]:
+        return embed_batches(self.embeddings, batches)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+def embedding_model_key(model_name: str, backend: str = "torch", max_seq_length: Optional[int] = None) -> str:
+    """Ключ кэшей embeddings: одинаковый текст даёт одинаковый вектор только при том же ключе"""
+    key = f"{model_name}@{backend}"
+    return f"{key}:{max_seq_length}" if max_seq_length else key
+
+
+def _model_slug(model_name: str) -> str:
+    """Имя модели → имя папки"""
+    return re.sub(r'[^\w.-]+', '_', model_name)
+
+
+# Бэкенды инференса:
+# - torch      - SentenceTransformer fp32 (CPU или GPU), как раньше
+# - onnx       - тот же граф в ONNX Runtime (CPU)
+# - onnx-int8  - ONNX с динамической int8 квантизацией (экспорт один раз, кэшируется на диске)
+# - int8       - динамическая int8 квантизация Linear слоёв torch (без доп. зависимостей)
+# ONNX бэкенды требуют optimum[onnxruntime]
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8", "int8")
+
+ONNX_QUANTIZATION = "avx2"
+
+# Контрольные фразы для сравнения квантованной модели с fp32
+PARITY_PROBES = [
+    "Что такое космоэнергетика и как она работает?",
+    "Расскажи о частоте Фираст и её применении",
+    "Каналы, инициация и настройка на энергию",
+    "Медитация, дыхание и работа с вниманием",
+    "Список частот с описанием для начинающих",
+    "The quick brown fox jumps over the lazy dog",
+]
+
+# Ниже этого косинуса к fp32 поиск по базе из fp32 векторов заметно деградирует
+MIN_PARITY_COSINE = 0.98
+
+
+def prepare_onnx_int8_model(model_name: str, onnx_dir: str, quantization: str = ONNX_QUANTIZATION) -> Tuple[Path, str]:
+    """
+    Экспорт модели в ONNX + динамическая int8 квантизация (один раз, дальше с диска)
+
+    Returns:
+        (папка модели, путь к квантованному .onnx внутри неё)
+    """
+    target = Path(onnx_dir) / _model_slug(model_name)
+    file_name = f"onnx/model_qint8_{quantization}.onnx"
+    if not (target / file_name).exists():
+        from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+        print(f"Exporting {model_name} to int8 ONNX ({quantization}): {target}")
+        model = SentenceTransformer(model_name, device='cpu', backend='onnx')
+        model.save(str(target))
+        export_dynamic_quantized_onnx_model(model, quantization, str(target))
+    return target, file_name
+
+
+def sentence_transformer_kwargs(model_name: str, backend: str = "torch", device: str = "cpu",
+                                onnx_dir: Optional[str] = None) -> Tuple[str, dict]:
+    """Путь к модели и параметры SentenceTransformer(...) для выбранного бэкенда"""
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend} (expected one of {EMBEDDING_BACKENDS})")
+
+    if backend == "torch":
+        return model_name, {'device': device}
+    if backend == "int8":
+        # Квантизация применяется после загрузки (quantize_int8)
+        return model_name, {'device': 'cpu'}
+    if backend == "onnx":
+        return model_name, {'device': 'cpu', 'backend': 'onnx'}
+
+    path, file_name = prepare_onnx_int8_model(model_name, onnx_dir or "onnx_models")
+    return str(path), {'device': 'cpu', 'backend': 'onnx', 'model_kwargs': {'file_name': file_name}}
+
+
+def quantize_int8(model):
+    """Динамическая int8 квантизация Linear слоёв SentenceTransformer (torch, CPU, in-place)"""
+    import torch
+    torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+
+def load_sentence_transformer(model_name: str, backend: str = "torch", device: str = "cpu",
+                              onnx_dir: Optional[str] = None):
+    """Загрузка SentenceTransformer с выбранным бэкендом"""
+    from sentence_transformers import SentenceTransformer
+
+    path, kwargs = sentence_transformer_kwargs(model_name, backend, device, onnx_dir)
+    model = SentenceTransformer(path, **kwargs)
+    if backend == "int8":
+        quantize_int8(model)
+    return model
+
+
+def embedding_cosines(reference, candidate) -> np.ndarray:
+    """Косинус между соответствующими строками двух матриц векторов"""
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    dots = np.einsum('ij,ij->i', reference, candidate)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    return dots / np.maximum(norms, 1e-12)
+
+
+def check_embedding_parity(reference, candidate, min_cosine: float = MIN_PARITY_COSINE,
+                           label: str = "") -> float:
+    """
+    Проверка, что векторы кандидата совпадают с эталонными fp32 по направлению
+
+    Raises:
+        ValueError: минимальный косинус ниже min_cosine
+    Returns:
+        минимальный косинус
+    """
+    cosines = embedding_cosines(reference, candidate)
+    worst = float(cosines.min())
+    print(f"Embedding parity{f' ({label})' if label else ''}: "
+          f"min cos {worst:.4f}, mean cos {float(cosines.mean()):.4f} on {len(cosines)} texts")
+    if worst < min_cosine:
+        raise ValueError(
+            f"Embedding backend drifted from fp32: min cosine {worst:.4f} < {min_cosine}. "
+            f"Use embedding_backend='torch' or rebuild the database with this backend."
+        )
+    return worst
+
+
+def create_backend_embeddings(
+    model_name: str,
+    backend: str = "torch",
+    device: str = "cpu",
+    encode_kwargs: Optional[dict] = None,
+    onnx_dir: Optional[str] = None,
+    verify_parity: bool = True
+) -> HuggingFaceEmbeddings:
+    """
+    HuggingFaceEmbeddings на выбранном бэкенде
+
+    Для квантованных/ONNX бэкендов (всегда CPU) векторы контрольных фраз
+    сравниваются с fp32 моделью: базы собраны fp32 векторами, и запросы
+    должны попадать в то же пространство.
+    """
+    path, model_kwargs = sentence_transformer_kwargs(model_name, backend, device, onnx_dir)
+    embeddings = HuggingFaceEmbeddings(
+        model_name=path,
+        model_kwargs=model_kwargs,
+        encode_kwargs=encode_kwargs or {}
+    )
+    if backend == "torch":
+        return embeddings
+
+    print(f"Embedding backend: {backend} (CPU)")
+    reference = None
+    if verify_parity:
+        if backend == "int8":
+            # Эталон - та же модель до квантизации
+            reference = embeddings.client.encode(PARITY_PROBES, normalize_embeddings=True)
+        else:
+            reference_model = load_sentence_transformer(model_name, "torch", "cpu")
+            reference = reference_model.encode(PARITY_PROBES, normalize_embeddings=True)
+            del reference_model
+
+    if backend == "int8":
+        quantize_int8(embeddings.client)
+
+    if reference is not None:
+        candidate = embeddings.client.encode(PARITY_PROBES, normalize_embeddings=True)
+        check_embedding_parity(reference, candidate, label=f"{backend} vs fp32")
+    return embeddings
+
+
+# Состояние процесса-воркера (своя копия модели в каждом процессе)
+_worker_model = None
+_worker_batch_size = 32
+_worker_encode_kwargs = {}
+
+
+def _init_embedding_worker(model_name: str, threads: int, batch_size: int,
+                           max_seq_length: Optional[int], encode_kwargs: dict,
+                           backend: str = "torch", onnx_dir: Optional[str] = None):
+    """Инициализация воркера: число потоков torch + загрузка модели на CPU"""
+    global _worker_model, _worker_batch_size, _worker_encode_kwargs
+
+    import torch
+    torch.set_num_threads(threads)
+
+    _worker_model = load_sentence_transformer(model_name, backend, 'cpu', onnx_dir)
+    if max_seq_length:
+        _worker_model.max_seq_length = max_seq_length
+
+    _worker_batch_size = batch_size
+    _worker_encode_kwargs = encode_kwargs
+
+
+def _embed_in_worker(texts: List[str]) -> List[List[float]]:
+    if not texts:
+        return []
+    return encode_length_bucketed(_worker_model, texts, _worker_batch_size, _worker_encode_kwargs).tolist()
+
+
+class ProcessPoolEmbeddings(EmbeddingsWrapper):
+    """
+    Векторизация документов в N процессах на CPU
+
+    Каждый воркер загружает свою копию модели и использует cpu_count // N потоков
+    torch (без переподписки ядер). Батчи отправляются воркерам потоком, не более
+    2 x N батчей одновременно, результаты возвращаются строго в исходном порядке -
+    их можно писать в ChromaDB сразу по мере готовности.
+
+    Запросы (embed_query) выполняются моделью текущего процесса.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str,
+        num_workers: int,
+        threads_per_worker: Optional[int] = None,
+        batch_size: int = 32,
+        max_seq_length: Optional[int] = None,
+        encode_kwargs: Optional[dict] = None,
+        backend: str = "torch",
+        onnx_dir: Optional[str] = None
+    ):
+        super().__init__(embeddings)
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+        self.max_in_flight = num_workers * 2
+
+        encode_kwargs = {k: v for k, v in (encode_kwargs or {}).items() if k != 'batch_size'}
+
+        # spawn: у воркера чистый torch без унаследованных потоков OpenMP.
+        # Процессы стартуют при первом батче, до этого пул ничего не стоит.
+        self._executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_embedding_worker,
+            initargs=(model_name, self.threads_per_worker, batch_size, max_seq_length, encode_kwargs,
+                      backend, onnx_dir)
+        )
+
+    def embed_batches(self, batches: Iterable[List[str]]) -> Iterator[List[List[float]]]:
+        pending = deque()
+        for texts in batches:
+            pending.append(self._executor.submit(_embed_in_worker, list(texts)))
+            if len(pending) >= self.max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # Один вызов - делим на N непрерывных шардов, по одному на воркер
+        shard_size = -(-len(texts) // self.num_workers)
+        shards = [texts[i:i + shard_size] for i in range(0, len(texts), shard_size)]
+        vectors = []
+        for shard_vectors in self.embed_batches(shards):
+            vectors.extend(shard_vectors)
+        return vectors
+
+    def close(self):
+        """Остановка процессов-воркеров"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class DiskEmbeddingCache(EmbeddingsWrapper):
+    """
+    Персистентный кэш embeddings, ключ - (model_key, sha1 текста)
+
+    model_key (см. embedding_model_key) различает модель, бэкенд и max_seq_length:
+    векторы onnx-int8/int8 и обрезанных текстов не смешиваются с векторами fp32.
+
+    Хранение (отдельная папка на каждый model_key):
+    - vectors.f32    - плоский массив float32 [rows x dim], читается через np.memmap
+    - index.sqlite   - индекс sha1 → номер строки в vectors.f32
+
+    Кэш общий для всех баз (chroma_db_labse, chroma_db_ultimate, ...) и переживает
+    перезапуски: пересборка базы или смена chunk_size векторизует только новые тексты.
+    Запись защищена транзакцией SQLite (BEGIN IMMEDIATE), поэтому несколько
+    процессов сборки могут использовать один кэш.
+    """
+
+    SQLITE_MAX_VARS = 900  # лимит параметров в одном SQL запросе
+
+    def __init__(self, embeddings: Embeddings, model_key: str, cache_dir: str):
+        super().__init__(embeddings)
+        self.model_key = model_key
+
+        self.cache_path = Path(cache_dir) / _model_slug(model_key)
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.cache_path / "vectors.f32"
+        self.vectors_path.touch(exist_ok=True)
+
+        self._db = sqlite3.connect(
+            str(self.cache_path / "index.sqlite"),
+            check_same_thread=False,
+            isolation_level=None  # транзакции управляются вручную
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS vectors (hash TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+        self._lock = threading.Lock()
+        self._mmap = None
+        self.dim = self._read_dim()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _read_dim(self):
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        return int(row[0]) if row else None
+
+    def _row_bytes(self) -> int:
+        return self.dim * 4
+
+    def _lookup(self, hashes: List[str]) -> Dict[str, int]:
+        """sha1 → номер строки для тех хэшей, что уже есть в кэше"""
+        found = {}
+        unique = list(set(hashes))
+        for start in range(0, len(unique), self.SQLITE_MAX_VARS):
+            part = unique[start:start + self.SQLITE_MAX_VARS]
+            placeholders = ",".join("?" * len(part))
+            for h, row in self._db.execute(
+                f"SELECT hash, row FROM vectors WHERE hash IN ({placeholders})", part
+            ):
+                found[h] = row
+        return found
+
+    def _read_rows(self, rows: List[int]) -> np.ndarray:
+        """Чтение векторов из memmap (переоткрывается, если файл вырос)"""
+        if self.dim is None:
+            # Размерность мог записать другой процесс
+            self.dim = self._read_dim()
+        needed = max(rows) + 1
+        if self._mmap is None or self._mmap.shape[0] < needed:
+            total_rows = os.path.getsize(self.vectors_path) // self._row_bytes()
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(total_rows, self.dim))
+        return np.asarray(self._mmap[rows])
+
+    def _append(self, hashes: List[str], vectors: np.ndarray):
+        """Дописывает векторы в конец файла и регистрирует их в индексе"""
+        self._db.execute("BEGIN IMMEDIATE")  # блокировка от других процессов-писателей
+        try:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dim', ?)", (str(self.dim),))
+
+            with open(self.vectors_path, 'r+b') as f:
+                # Хвост от прерванной записи (неполная строка) отбрасываем
+                size = f.seek(0, os.SEEK_END)
+                first_row = size // self._row_bytes()
+                f.truncate(first_row * self._row_bytes())
+                f.seek(first_row * self._row_bytes())
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            # Векторы уже на диске - только теперь индекс начинает на них ссылаться
+            self._db.executemany(
+                "INSERT OR IGNORE INTO vectors (hash, row) VALUES (?, ?)",
+                [(h, first_row + i) for i, h in enumerate(hashes)]
+            )
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return next(self.embed_batches([texts]))
+
+    def embed_batches(self, batches: Iterable[List[str]]) -> Iterator[List[List[float]]]:
+        """
+        Потоковая векторизация с кэшем: во внутреннюю модель уходят только промахи
+
+        Поток промахов передаётся дальше тоже генератором, поэтому пул процессов
+        (ProcessPoolEmbeddings) продолжает работать без остановок.
+        """
+        pending = deque()
+
+        def missing_batches():
+            for texts in batches:
+                hashes = [hashlib.sha1(t.encode('utf-8')).hexdigest() for t in texts]
+                with self._lock:
+                    found = self._lookup(hashes)
+
+                # Промахи (без дубликатов внутри батча)
+                missing = {}
+                for h, text in zip(hashes, texts):
+                    if h not in found and h not in missing:
+                        missing[h] = text
+
+                pending.append((hashes, found, list(missing)))
+                yield list(missing.values())
+
+        for vectors in embed_batches(self.embeddings, missing_batches()):
+            hashes, found, missing_hashes = pending.popleft()
+
+            with self._lock:
+                computed = {}
+                if missing_hashes:
+                    vectors = np.asarray(vectors, dtype=np.float32)
+                    self._append(missing_hashes, vectors)
+                    computed = dict(zip(missing_hashes, vectors))
+
+                # Попадание - текст, который был в кэше до батча (повтор промаха внутри
+                # батча векторизуется один раз, но попаданием не считается)
+                hits = sum(h in found for h in hashes)
+                self.hits += hits
+                self.misses += len(hashes) - hits
+
+                cached_rows = {}
+                hit_hashes = [h for h in set(hashes) if h in found]
+                if hit_hashes:
+                    rows = [found[h] for h in hit_hashes]
+                    cached_rows = dict(zip(hit_hashes, self._read_rows(rows)))
+
+            yield [
+                (computed[h] if h in computed else cached_rows[h]).tolist()
+                for h in hashes
+            ]
+
+    def stats(self) -> dict:
+        """Статистика кэша"""
+        total = self.hits + self.misses
+        return {
+            "model": self.model_key,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "cache_path": str(self.cache_path)
+        }
@@ -0,0 +1,182 @@
+"""
+Точный векторный поиск по memory-mapped float16 матрице
+Альтернатива HNSW в ChromaDB: вся коллекция выгружается в одну непрерывную
+матрицу (<db_path>/exact_index/), top-k считается полным перебором -
+детерминированный recall без приближения
+
+142k чанков x 1024 (e5-large) x 2 байта ≈ 290 MB. Матрица открывается через
+np.memmap (только чтение), поэтому страницы файла лежат в page cache ОС один раз
+и общие для всех процессов (Gradio воркеры, ProcessPool), открывших тот же индекс.
+"""
+
+import json
+import os
+import shutil
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Ранжированный список: [(chunk_id, score)] по убыванию score (как rag_retrieval.Ranking)
+Ranking = List[Tuple[str, float]]
+
+EXACT_INDEX_DIR = "exact_index"
+INDEX_FORMAT = 1
+
+# Строк матрицы за один матрично-векторный продукт (8192 x 1024 float32 = 32 MB)
+BLOCK_ROWS = 8192
+
+
+def _unit(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+class ExactIndex:
+    """
+    Нормированные векторы коллекции (float16, memmap) + chunk_id по строкам
+
+    Скор = косинусная близость (скалярное произведение единичных векторов).
+    """
+
+    def __init__(self, path: str, matrix: np.ndarray, ids: np.ndarray, block_rows: int = BLOCK_ROWS):
+        self.path = path
+        self.matrix = matrix
+        self.ids = ids
+        self.block_rows = block_rows
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def __reduce__(self):
+        # В другой процесс передаётся только путь: воркер открывает тот же файл,
+        # страницы общие, матрица не копируется через pickle
+        return ExactIndex.load, (os.path.dirname(self.path),)
+
+    @staticmethod
+    def index_path(db_path: str) -> str:
+        return os.path.join(db_path, EXACT_INDEX_DIR)
+
+    @classmethod
+    def build(cls, collection, db_path: str, page_size: int = 5000) -> "ExactIndex":
+        """
+        Выгрузка векторов коллекции ChromaDB в <db_path>/exact_index/
+
+        Запись во временную папку и rename: читатели никогда не видят
+        частично записанную матрицу.
+        """
+        path = cls.index_path(db_path)
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        count = collection.count()
+        matrix = None
+        ids = []
+        offset = 0
+        while offset < count:
+            page = collection.get(include=['embeddings'], limit=page_size, offset=offset)
+            if not page['ids']:
+                break
+            vectors = _unit(np.asarray(page['embeddings'], dtype=np.float32))
+            if matrix is None:
+                matrix = np.lib.format.open_memmap(
+                    os.path.join(tmp_path, "embeddings.npy"), mode='w+',
+                    dtype=np.float16, shape=(count, vectors.shape[1])
+                )
+            matrix[offset:offset + len(vectors)] = vectors
+            ids.extend(page['ids'])
+            offset += len(page['ids'])
+
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(
+                os.path.join(tmp_path, "embeddings.npy"), mode='w+', dtype=np.float16, shape=(0, 0)
+            )
+        matrix.flush()
+        del matrix
+        # Коллекция могла уменьшиться во время выгрузки - храним столько строк, сколько ID
+        np.save(os.path.join(tmp_path, "ids.npy"), np.asarray(ids, dtype=str))
+        with open(os.path.join(tmp_path, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump({'format': INDEX_FORMAT, 'count': len(ids)}, f)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return cls.load(db_path)
+
+    @classmethod
+    def load(cls, db_path: str) -> Optional["ExactIndex"]:
+        """Открыть индекс базы (None - индекса нет, он пустой или старый формат)"""
+        path = cls.index_path(db_path)
+        try:
+            with open(os.path.join(path, "meta.json"), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('format') != INDEX_FORMAT or not meta.get('count'):
+            return None  # пустой индекс (например, от прерванной сборки) = индекса нет
+        matrix = np.load(os.path.join(path, "embeddings.npy"), mmap_mode='r')
+        ids = np.load(os.path.join(path, "ids.npy"))
+        return cls(path, matrix[:meta['count']], ids)
+
+    @staticmethod
+    def remove(db_path: str):
+        """Удалить индекс (после изменения коллекции он будет пересобран)"""
+        shutil.rmtree(ExactIndex.index_path(db_path), ignore_errors=True)
+
+    def search_rows(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k строк для пачки запросов
+
+        Матрица проходится блоками по block_rows строк: блок x запросы.T,
+        argpartition оставляет k лучших в блоке, они сливаются с текущими лучшими.
+        Полная сортировка - только по k финальным кандидатам.
+
+        Returns:
+            (rows [n_queries x k], scores [n_queries x k]) по убыванию скора
+        """
+        queries = _unit(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        k = min(k, len(self))
+        if k <= 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        best_rows = np.empty((0, len(queries)), dtype=np.int64)
+        best_scores = np.empty((0, len(queries)), dtype=np.float32)
+        for start in range(0, len(self), self.block_rows):
+            block = np.asarray(self.matrix[start:start + self.block_rows], dtype=np.float32)
+            scores = block @ queries.T
+            if len(block) > k:
+                top = np.argpartition(-scores, k - 1, axis=0)[:k]
+                scores = np.take_along_axis(scores, top, axis=0)
+            else:
+                top = np.broadcast_to(np.arange(len(block))[:, None], scores.shape)
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores])
+            if len(best_rows) > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=0)[:k]
+                best_rows = np.take_along_axis(best_rows, keep, axis=0)
+                best_scores = np.take_along_axis(best_scores, keep, axis=0)
+
+        order = np.argsort(-best_scores, axis=0, kind='stable')
+        best_rows = np.take_along_axis(best_rows, order, axis=0)
+        best_scores = np.take_along_axis(best_scores, order, axis=0)
+        return best_rows.T, best_scores.T
+
+    def search_batch(self, queries: Sequence[Sequence[float]], k: int = 10) -> List[Ranking]:
+        """Top-k для нескольких векторов запросов за один проход по матрице"""
+        rows, scores = self.search_rows(queries, k)
+        return [
+            [(str(self.ids[row]), float(score)) for row, score in zip(query_rows, query_scores)]
+            for query_rows, query_scores in zip(rows, scores)
+        ]
+
+    def search(self, query: Sequence[float], k: int = 10) -> Ranking:
+        """Top-k для одного вектора запроса: [(chunk_id, косинусная близость)]"""
+        return self.search_batch([query], k)[0]
+
+    def vectors(self, rows: Sequence[int]) -> np.ndarray:
+        """Нормированные векторы строк (float32)"""
+        return np.asarray(self.matrix[np.asarray(rows)], dtype=np.float32)
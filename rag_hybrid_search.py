@@ -6,21 +6,23 @@
 from rag_knowledge_base import LocalRAG
 from pathlib import Path
 import re
+import time
 
 class HybridRAG(LocalRAG):
     """RAG с гибридным поиском: векторный + keyword"""
 
-    def hybrid_search(self, query: str, k: int = 10, keyword_boost: float = 4.0):
+    def hybrid_search(self, query: str, k: int = 10, fusion: str = "rrf", keyword_weight: float = 1.0):
         """
         Гибридный поиск:
-        1. Векторный поиск (MMR) - находит семантически похожие документы
-        2. Keyword фильтрация - проверяет наличие ключевых слов из запроса
-        3. Бустинг - повышает ранг документов с точным совпадением
+        1. Векторный поиск - кандидаты с косинусной близостью
+        2. Keyword поиск (BM25) - кандидаты по именам собственным из запроса
+        3. Слияние - RRF по рангам или взвешенная сумма нормированных скоров
 
         Args:
             query: поисковый запрос
             k: количество документов
-            keyword_boost: коэффициент усиления для документов с точным совпадением
+            fusion: "rrf" или "weighted"
+            keyword_weight: вес keyword результатов относительно векторных
         """
         # Извлекаем ТОЛЬКО имена собственные (слова с заглавной буквы, >=4 символа)
         # ИСКЛЮЧАЕМ служебные слова
@@ -31,82 +33,32 @@ class HybridRAG(LocalRAG):
 
         print(f"Ключевые термины (имена собственные): {keywords}")
 
-        # 1. ПРЯМОЙ KEYWORD ПОИСК в ChromaDB (если есть имена собственные)
-        if keywords:
-            # Используем where_document для прямого поиска
-            import chromadb
-            client = chromadb.PersistentClient(path=self.db_path)
-            collection = client.get_collection(name="langchain")
-
-            # Прямой поиск по keyword
-            keyword_docs = []
-            for keyword in keywords:
-                # ChromaDB where_document с $contains
-                results = collection.get(
-                    where_document={"$contains": keyword},
-                    include=["documents", "metadatas"],
-                    limit=k * 2  # Берем больше для разнообразия
-                )
-
-                # Конвертируем в LangChain Document objects
-                from langchain.docstore.document import Document
-                for i, doc_text in enumerate(results['documents']):
-                    meta = results['metadatas'][i] if results['metadatas'] else {}
-                    keyword_docs.append(Document(page_content=doc_text, metadata=meta))
-
-            print(f"Keyword поиск нашел: {len(keyword_docs)} документов с '{keywords}'")
-
-            # Если нашли документы по keyword - используем их
-            if keyword_docs:
-                vector_docs = keyword_docs
-            else:
-                # Fallback: векторный поиск если keyword не нашел
-                vector_docs = self.vectorstore.max_marginal_relevance_search(
-                    query, k=k * 3, fetch_k=k * 9, lambda_mult=0.5
-                )
-                print(f"Keyword не нашел, fallback на векторный: {len(vector_docs)} документов")
-        else:
-            # Нет ключевых слов - обычный векторный поиск
-            vector_docs = self.vectorstore.max_marginal_relevance_search(
-                query, k=k * 3, fetch_k=k * 9, lambda_mult=0.5
-            )
-            print(f"Векторный поиск нашел: {len(vector_docs)} документов")
-
-        # 2. Keyword фильтрация и ранжирование
-        scored_docs = []
-        for doc in vector_docs:
-            content = doc.page_content
-            score = 1.0  # Базовый скор от векторного поиска
-
-            # Подсчет совпадений ключевых слов
-            matches = 0
-            for keyword in keywords:
-                if keyword in content or keyword.lower() in content.lower():
-                    matches += 1
-
-            # Бустинг документов с ключевыми словами
-            if matches > 0:
-                score = score * (keyword_boost ** matches)
+        # Векторный + BM25 поиск (по 2k кандидатов) и слияние по скорам
+        started = time.perf_counter()
+        results = self.fused_search(
+            query,
+            k=k,
+            keywords=keywords,
+            fusion=fusion,
+            keyword_weight=keyword_weight
+        )
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f"Гибридный поиск ({fusion}): {len(results)} документов за {elapsed_ms:.1f} ms")
+
+        # Статистика: совпадения ключевых слов по предвычисленным основам чанков
+        matches = self.load_keyword_index().count_matches([doc.id for doc, _ in results], keywords)
+        scored_docs = [(score, doc, m) for (doc, score), m in zip(results, matches)]
 
-            scored_docs.append((score, doc, matches))
-
-        # Сортировка по скору
-        scored_docs.sort(key=lambda x: x[0], reverse=True)
-
-        # Статистика
         docs_with_keywords = sum(1 for _, _, m in scored_docs if m > 0)
         print(f"Документов с ключевыми словами: {docs_with_keywords}/{len(scored_docs)}")
 
-        # Возврат топ-k документов
-        result_docs = [doc for _, doc, _ in scored_docs[:k]]
-
         # Debug info
         print("\nТоп-5 документов:")
         for i, (score, doc, matches) in enumerate(scored_docs[:5], 1):
             preview = doc.page_content[:100].replace('\n', ' ')
-            print(f"  [{i}] Score: {score:.2f}, Keywords: {matches}, Preview: {preview}...")
+            print(f"  [{i}] Score: {score:.4f}, Keywords: {matches}, Preview: {preview}...")
 
-        return result_docs
+        return [doc for _, doc, _ in scored_docs]
 
     def query_hybrid(self, question: str, max_tokens: int = 2000, temperature: float = 0.7) -> dict:
         """Запрос с гибридным поиском"""
@@ -181,11 +133,7 @@ def main():
     )
 
     # Загрузка базы
-    from langchain_community.vectorstores import Chroma
-    rag.vectorstore = Chroma(
-        persist_directory=DB_PATH,
-        embedding_function=rag.embeddings
-    )
+    rag.load_vectorstore()
 
     print(f"База загружена: {DB_PATH}")
     print(f"Документов: {rag.vectorstore._collection.count()}")
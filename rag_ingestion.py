@@ -0,0 +1,566 @@
+"""
+Потоковая загрузка текста для RAG
+Читает файл окнами и отдаёт чанки генератором - память не растёт с размером корпуса
+Конвейер чтение/разбиение → embedding → запись в ChromaDB с ограниченными очередями
+"""
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from rag_embeddings import embed_batches
+
+# Те же разделители, что и в LocalRAG.load_and_split_documents
+SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
+
+# Размер окна чтения (в символах). 1M символов ≈ 2 MB для русского текста
+DEFAULT_WINDOW_SIZE = 1_000_000
+
+
+def make_text_splitter(chunk_size: int = 1000, chunk_overlap: int = 200) -> RecursiveCharacterTextSplitter:
+    """Splitter с параметрами, идентичными load_and_split_documents"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        separators=SEPARATORS
+    )
+
+
+def _find_window_cut(text: str) -> int:
+    """
+    Точка разреза окна: последняя граница абзаца (или строки)
+
+    Splitter в первую очередь режет по "\\n\\n", поэтому разрез окна по границе
+    абзаца почти не меняет итоговые чанки - отличия возможны только на стыке окон
+    """
+    cut = text.rfind("\n\n")
+    if cut <= 0:
+        cut = text.rfind("\n")
+    if cut <= 0:
+        # Нет переносов строк во всём окне - режем как есть
+        cut = len(text)
+    return cut
+
+
+class TextSpan(NamedTuple):
+    """Чанк и его точное место в исходном файле"""
+    text: str
+    start_byte: int   # смещение первого байта чанка в файле
+    end_byte: int     # смещение после последнего байта (end_byte - start_byte = длина в байтах)
+    start_line: int   # номер строки первого символа (с 1)
+    end_line: int     # номер строки последнего символа
+
+
+def _normalize_newlines(raw: str) -> Tuple[str, Optional[List[int]]]:
+    """
+    "\r\n" и "\r" → "\n" (как при обычном open() в текстовом режиме)
+
+    Returns:
+        (нормализованный текст, позиции символов в raw) - None, если текст не менялся
+    """
+    if "\r" not in raw:
+        return raw, None
+    # "\r\n" → позиция "\r" (начало последовательности), "\n" после него выпадает
+    positions = [i for i, ch in enumerate(raw) if not (ch == "\n" and i > 0 and raw[i - 1] == "\r")]
+    text = raw.replace("\r\n", "\n").replace("\r", "\n")
+    return text, positions
+
+
+class _Cursor:
+    """Монотонный курсор по тексту окна: позиция символа → байт / номер строки"""
+
+    def __init__(self, raw: str, text: str, positions: Optional[List[int]], encoding: str,
+                 byte_base: int, line_base: int):
+        self.raw, self.text, self.positions, self.encoding = raw, text, positions, encoding
+        self.char = 0          # позиция в нормализованном тексте
+        self.raw_char = 0      # та же позиция в raw
+        self.byte = byte_base
+        self.line = line_base
+
+    def raw_pos(self, pos: int) -> int:
+        if self.positions is None:
+            return pos
+        return self.positions[pos] if pos < len(self.positions) else len(self.raw)
+
+    def advance(self, pos: int):
+        """Сдвиг к позиции pos (pos не меньше текущей)"""
+        raw_pos = self.raw_pos(pos)
+        self.byte += len(self.raw[self.raw_char:raw_pos].encode(self.encoding))
+        self.line += self.text.count("\n", self.char, pos)
+        self.char, self.raw_char = pos, raw_pos
+
+    def span_end(self, end: int) -> Tuple[int, int]:
+        """
+        (байт после символа end - 1, номер строки символа end - 1) от текущей позиции
+
+        Считается от начала чанка, а не общим курсором: конец следующего чанка
+        может оказаться раньше конца предыдущего (короткий чанк внутри перекрытия).
+        """
+        end_byte = self.byte + len(self.raw[self.raw_char:self.raw_pos(end)].encode(self.encoding))
+        end_line = self.line + self.text.count("\n", self.char, max(self.char, end - 1))
+        return end_byte, end_line
+
+
+def iter_text_spans(
+    text_file_path: str,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 200,
+    window_size: int = DEFAULT_WINDOW_SIZE,
+    encoding: str = 'utf-8'
+) -> Iterator[TextSpan]:
+    """
+    Генератор чанков с координатами: файл читается окнами по window_size символов
+
+    В памяти одновременно находится только одно окно (+ хвост до границы абзаца)
+    и чанки этого окна, а не весь документ и весь список splits.
+    Для каждого чанка известны байтовые смещения и диапазон строк в файле -
+    источник находится seek'ом, без повторного сканирования.
+
+    Args:
+        text_file_path: путь к текстовому файлу
+        chunk_size: размер чанка (как в RecursiveCharacterTextSplitter)
+        chunk_overlap: перекрытие между чанками
+        window_size: размер окна чтения в символах
+        encoding: кодировка файла
+    """
+    if window_size <= chunk_size:
+        raise ValueError(f"window_size ({window_size}) должен быть больше chunk_size ({chunk_size})")
+
+    splitter = make_text_splitter(chunk_size, chunk_overlap)
+    carry = ""
+    byte_base, line_base = 0, 1
+
+    # newline='' - символы файла без перевода строк, иначе байтовые смещения разъедутся;
+    # сами чанки нормализуются как раньше ("\r\n" → "\n")
+    with open(text_file_path, 'r', encoding=encoding, newline='') as f:
+        while True:
+            block = f.read(window_size)
+            eof = not block
+            if block.endswith("\r"):
+                # Не разрываем "\r\n" между окнами
+                block += f.read(1)
+            raw = carry + block
+
+            if not raw:
+                break
+
+            text, positions = _normalize_newlines(raw)
+            if eof:
+                cut = len(text)
+            else:
+                cut = _find_window_cut(text)
+            head = text[:cut]
+
+            starts = _Cursor(raw, text, positions, encoding, byte_base, line_base)
+            search_from, previous_len = 0, 0
+            for chunk in splitter.split_text(head):
+                # Как add_start_index у splitter: ищем чанк после предыдущего минус перекрытие,
+                # но не раньше начала предыдущего - курсор начал идёт только вперёд
+                index = head.find(chunk, max(search_from, search_from + previous_len - chunk_overlap))
+                if index < 0:
+                    index = head.find(chunk, search_from)
+                if index < 0:
+                    index = head.find(chunk)
+                    starts = _Cursor(raw, text, positions, encoding, byte_base, line_base)
+                search_from, previous_len = index, len(chunk)
+
+                starts.advance(index)
+                end_byte, end_line = starts.span_end(index + len(chunk))
+                yield TextSpan(chunk, starts.byte, end_byte, starts.line, end_line)
+
+            if eof:
+                break
+
+            # Хвост окна переходит в следующее окно
+            base = _Cursor(raw, text, positions, encoding, byte_base, line_base)
+            base.advance(cut)
+            byte_base, line_base = base.byte, base.line
+            carry = raw[base.raw_char:]
+
+
+def iter_text_chunks(
+    text_file_path: str,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 200,
+    window_size: int = DEFAULT_WINDOW_SIZE,
+    encoding: str = 'utf-8'
+) -> Iterator[str]:
+    """Генератор текстов чанков (см. iter_text_spans)"""
+    for span in iter_text_spans(text_file_path, chunk_size, chunk_overlap, window_size, encoding):
+        yield span.text
+
+
+def chunk_metadata(source: str, chunk_index: int, span: TextSpan) -> dict:
+    """Метаданные чанка: источник, порядковый номер и координаты в файле"""
+    return {
+        'source': source,
+        'chunk_index': chunk_index,
+        'start_byte': span.start_byte,
+        'end_byte': span.end_byte,
+        'start_line': span.start_line,
+        'end_line': span.end_line,
+    }
+
+
+def read_source_span(source: str, start_byte: int, end_byte: int, encoding: str = 'utf-8') -> str:
+    """Текст чанка прямо из файла: seek + read, без сканирования"""
+    with open(source, 'rb') as f:
+        f.seek(start_byte)
+        data = f.read(end_byte - start_byte)
+    text = data.decode(encoding, errors='replace')
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def format_location(metadata: Optional[dict]) -> str:
+    """Короткая подпись места чанка в файле для UI: "строки 120-128" """
+    if not metadata or 'start_line' not in metadata:
+        return ""
+    start, end = metadata['start_line'], metadata['end_line']
+    return f"строка {start}" if start == end else f"строки {start}-{end}"
+
+
+def content_digest(content: str) -> str:
+    """sha1 текста чанка"""
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def chunk_id(content: str, occurrence: int = 0) -> str:
+    """
+    Content-addressed ID чанка: sha1 текста + номер повтора этого текста
+
+    Позиция учитывается как порядковый номер среди ОДИНАКОВЫХ чанков, а не как
+    абсолютный индекс: иначе вставка одного абзаца в начало файла сдвинула бы
+    ID всех последующих чанков и вызвала бы полную переиндексацию.
+    """
+    return f"{content_digest(content)}-{occurrence}"
+
+
+def iter_with_chunk_ids(documents: Iterable) -> Iterator[Tuple[str, object]]:
+    """Генератор пар (chunk_id, document) для потока LangChain Document"""
+    occurrences = {}
+    for doc in documents:
+        digest = content_digest(doc.page_content)
+        occurrence = occurrences.get(digest, 0)
+        occurrences[digest] = occurrence + 1
+        yield f"{digest}-{occurrence}", doc
+
+
+def fetch_collection_ids(collection, page_size: int = 10000) -> Set[str]:
+    """Все ID коллекции ChromaDB (постранично, без документов и векторов)"""
+    ids = set()
+    offset = 0
+    while True:
+        page = collection.get(include=[], limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        ids.update(page['ids'])
+        offset += len(page['ids'])
+    return ids
+
+
+def fetch_collection_metadatas(collection, page_size: int = 10000) -> Dict[str, dict]:
+    """ID → метаданные для всей коллекции ChromaDB (постранично, без документов и векторов)"""
+    metadatas = {}
+    offset = 0
+    while True:
+        page = collection.get(include=['metadatas'], limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        for chunk_id, metadata in zip(page['ids'], page['metadatas']):
+            metadatas[chunk_id] = metadata or {}
+        offset += len(page['ids'])
+    return metadatas
+
+
+def iter_batches(items: Iterable, batch_size: int) -> Iterator[List]:
+    """Группировка потока в списки по batch_size элементов"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_embedded_batches(embeddings, chunk_batches: Iterable[List[Tuple[str, object]]]) -> Iterator[Tuple[List, List]]:
+    """
+    Векторизация потока батчей [(chunk_id, document), ...]
+
+    Returns:
+        генератор (batch, vectors) в исходном порядке - по мере готовности векторов
+    """
+    pending = deque()
+
+    def texts():
+        for batch in chunk_batches:
+            pending.append(batch)
+            yield [doc.page_content for _, doc in batch]
+
+    for vectors in embed_batches(embeddings, texts()):
+        yield pending.popleft(), vectors
+
+
+def write_batch(collection, batch: List[Tuple[str, object]], vectors: List) -> None:
+    """Запись готовых векторов батча в коллекцию ChromaDB (без повторной векторизации)"""
+    collection.upsert(
+        ids=[chunk_id for chunk_id, _ in batch],
+        embeddings=vectors,
+        documents=[doc.page_content for _, doc in batch],
+        metadatas=[doc.metadata for _, doc in batch]
+    )
+
+
+class StageStats:
+    """Счётчики стадии конвейера: сколько обработано и сколько времени стадия работала"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.batches = 0
+        self.busy = 0.0      # время работы стадии (без ожидания очередей)
+        self.started = time.perf_counter()
+
+    def add(self, items: int, busy: float):
+        self.items += items
+        self.batches += 1
+        self.busy += busy
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.items / elapsed if elapsed > 0 else 0.0
+
+    def utilization(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.busy / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return f"[{self.name}] {self.items} chunks, {self.rate():.0f}/s, busy {self.utilization():.0%}"
+
+
+class _StageFailure:
+    """Исключение стадии, передаваемое через очередь в основной поток"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_END = object()
+
+
+class IngestionPipeline:
+    """
+    Конвейер ingestion: чтение/разбиение → embedding → запись
+
+    Стадии работают параллельно в отдельных потоках и связаны очередями
+    ограниченного размера (backpressure): если модель не успевает, чтение
+    останавливается, а не накапливает чанки в памяти. Чтение файла, подготовка
+    батчей и запись в ChromaDB прячутся за временем инференса модели.
+
+        reader (поток)  --queue-->  embedder (поток)  --queue-->  writer (вызывающий поток)
+
+    Каждые report_interval секунд печатается пропускная способность стадий.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        write_fn: Callable[[List, List], None],
+        batch_size: int = 256,
+        queue_size: int = 4,
+        report_interval: float = 5.0
+    ):
+        self.embeddings = embeddings
+        self.write_fn = write_fn
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+
+        self.read_stats = StageStats("read/split")
+        self.embed_stats = StageStats("embed")
+        self.write_stats = StageStats("write")
+
+        self._stop = threading.Event()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        """put с проверкой остановки (чтобы поток не завис на полной очереди)"""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _reader(self, chunks: Iterable, out_q: queue.Queue):
+        try:
+            batches = iter_batches(chunks, self.batch_size)
+            while True:
+                t0 = time.perf_counter()
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                self.read_stats.add(len(batch), time.perf_counter() - t0)
+                if not self._put(out_q, batch):
+                    return
+            self._put(out_q, _END)
+        except BaseException as e:
+            self._put(out_q, _StageFailure(e))
+
+    def _embedder(self, in_q: queue.Queue, out_q: queue.Queue):
+        waited = [0.0]
+
+        def incoming():
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    item = in_q.get(timeout=0.1)
+                except queue.Empty:
+                    if self._stop.is_set():
+                        return
+                    continue
+                finally:
+                    waited[0] += time.perf_counter() - t0
+                if item is _END:
+                    return
+                if isinstance(item, _StageFailure):
+                    raise item.error
+                yield item
+
+        try:
+            results = iter_embedded_batches(self.embeddings, incoming())
+            while True:
+                t0 = time.perf_counter()
+                waited[0] = 0.0
+                result = next(results, None)
+                if result is None:
+                    break
+                batch, vectors = result
+                self.embed_stats.add(len(batch), time.perf_counter() - t0 - waited[0])
+                if not self._put(out_q, (batch, vectors)):
+                    return
+            self._put(out_q, _END)
+        except BaseException as e:
+            self._put(out_q, _StageFailure(e))
+
+    def report(self, embed_q: queue.Queue, write_q: queue.Queue):
+        print(f"  {self.read_stats} | {self.embed_stats} | {self.write_stats} "
+              f"| queues {embed_q.qsize()}/{self.queue_size} {write_q.qsize()}/{self.queue_size}")
+
+    def run(self, chunks: Iterable[Tuple[str, object]]) -> int:
+        """
+        Запуск конвейера
+
+        Args:
+            chunks: поток (chunk_id, document)
+
+        Returns:
+            количество записанных чанков
+        """
+        embed_q = queue.Queue(maxsize=self.queue_size)
+        write_q = queue.Queue(maxsize=self.queue_size)
+
+        threads = [
+            threading.Thread(target=self._reader, args=(chunks, embed_q), name="ingest-reader", daemon=True),
+            threading.Thread(target=self._embedder, args=(embed_q, write_q), name="ingest-embedder", daemon=True),
+        ]
+        for t in threads:
+            t.start()
+
+        last_report = time.perf_counter()
+        try:
+            while True:
+                item = write_q.get()
+                if item is _END:
+                    break
+                if isinstance(item, _StageFailure):
+                    raise item.error
+
+                batch, vectors = item
+                t0 = time.perf_counter()
+                self.write_fn(batch, vectors)
+                self.write_stats.add(len(batch), time.perf_counter() - t0)
+
+                if time.perf_counter() - last_report >= self.report_interval:
+                    self.report(embed_q, write_q)
+                    last_report = time.perf_counter()
+        finally:
+            self._stop.set()
+            for t in threads:
+                t.join(timeout=5)
+
+        self.report(embed_q, write_q)
+        return self.write_stats.items
+
+
+class IngestCheckpoint:
+    """
+    Контрольная точка сборки базы (json в папке базы)
+
+    После записи батча в ChromaDB фиксируется позиция в потоке чанков
+    (не чаще раза в min_interval секунд): все чанки до неё уже есть в базе. Файл пишется атомарно (tmp + fsync + replace),
+    поэтому прерванная сборка всегда оставляет корректную контрольную точку.
+
+    Сигнатура (файл, размер, mtime, модель) защищает от продолжения сборки
+    по изменённому тексту или другой модели.
+    """
+
+    FILE_NAME = "ingest_checkpoint.json"
+
+    def __init__(self, db_path: str, signature: dict, min_interval: float = 2.0):
+        self.path = os.path.join(db_path, self.FILE_NAME)
+        self.signature = signature
+        self.min_interval = min_interval
+        self._last_save = 0.0
+
+    def load(self) -> Optional[dict]:
+        """Состояние незавершённой сборки с той же сигнатурой (иначе None)"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get('signature') != self.signature or state.get('complete'):
+            return None
+        return state
+
+    def save(self, position: int, last_chunk_id: str, written: int, complete: bool = False, force: bool = False):
+        """
+        Атомарная запись контрольной точки
+
+        Args:
+            position: сколько первых чанков потока уже гарантированно в базе
+            last_chunk_id: ID чанка на позиции position - 1 (для проверки при возобновлении)
+            written: сколько чанков записано в этом запуске
+            complete: сборка завершена полностью
+            force: записать сразу, без ограничения частоты
+        """
+        now = time.perf_counter()
+        if not force and now - self._last_save < self.min_interval:
+            return
+        self._last_save = now
+
+        state = {
+            'signature': self.signature,
+            'position': position,
+            'last_chunk_id': last_chunk_id,
+            'written': written,
+            'complete': complete,
+            'updated': time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,435 @@
+"""
+Инвертированный BM25 индекс для keyword поиска
+Строится при сборке базы и хранится внутри неё: <db_path>/keyword_index.npz
+Поиск - чтение списков постингов нужных терминов, без сканирования коллекции
+Для каждого чанка хранятся множества токенов и лемм - подсчёт совпадений
+ключевых слов без повторной нормализации текста на каждый запрос
+Индекс лемм: словоформа → лемма → чанки (поиск с учётом склонений одним обращением к словарю)
+"""
+
+import math
+import os
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r'\w+')
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 40  # словарь хранится строками фиксированной ширины - без URL и мусора
+
+# Версия формата keyword_index.npz: индекс другой версии пересобирается
+INDEX_FORMAT = 3
+
+CYRILLIC_PATTERN = re.compile(r'[а-яё]')
+
+# Окончания для лёгкого стемминга (длинные раньше коротких)
+RUSSIAN_ENDINGS = tuple(sorted({
+    'иями', 'ями', 'ами', 'иях', 'ией', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ых', 'их', 'ой', 'ей', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ую', 'юю', 'ая', 'яя',
+    'ое', 'ее', 'ые', 'ие', 'ий', 'ый', 'ов', 'ев', 'ия', 'ии', 'ию', 'ью',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+}, key=len, reverse=True))
+MIN_STEM_LENGTH = 4
+
+
+def normalize_text(text: str) -> str:
+    """Нижний регистр + ё → е"""
+    return text.lower().replace('ё', 'е')
+
+
+def tokenize(text: str) -> List[str]:
+    """Токены для индекса: слова из нормализованного текста без пунктуации (от 2 до 40 символов)"""
+    return [
+        t for t in TOKEN_PATTERN.findall(normalize_text(text))
+        if MIN_TOKEN_LENGTH <= len(t) <= MAX_TOKEN_LENGTH
+    ]
+
+
+def stem(token: str) -> str:
+    """
+    Лёгкая основа русского слова: срезается одно окончание, основа не короче 4 букв
+
+    "перуна", "перуну", "перуном" → "перун"; короткие и латинские слова не меняются.
+    """
+    for ending in RUSSIAN_ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= MIN_STEM_LENGTH:
+            return token[:-len(ending)]
+    return token
+
+
+class Lemmatizer:
+    """
+    Словоформа → лемма
+
+    С pymorphy3 (pip install pymorphy3) - словарная нормальная форма
+    ("фирасту" → "фираст", "энергией" → "энергия"), без него - лёгкий стемминг (stem).
+    Результаты кэшируются: каждая форма разбирается один раз.
+    """
+
+    def __init__(self):
+        try:
+            import pymorphy3
+            self._morph = pymorphy3.MorphAnalyzer()
+            self.name = "pymorphy3"
+        except ImportError:
+            self._morph = None
+            self.name = "stem"
+        self._cache = {}
+
+    def lemmatize(self, token: str) -> str:
+        lemma = self._cache.get(token)
+        if lemma is None:
+            if self._morph is not None and CYRILLIC_PATTERN.search(token):
+                lemma = normalize_text(self._morph.parse(token)[0].normal_form)
+            else:
+                lemma = stem(token)
+            self._cache[token] = lemma
+        return lemma
+
+
+_lemmatizer = None
+
+
+def get_lemmatizer() -> Lemmatizer:
+    """Общий для процесса лемматизатор (словарь pymorphy загружается один раз)"""
+    global _lemmatizer
+    if _lemmatizer is None:
+        _lemmatizer = Lemmatizer()
+    return _lemmatizer
+
+
+def _csr_row(offsets: np.ndarray, values: np.ndarray, row: int) -> np.ndarray:
+    return values[offsets[row]:offsets[row + 1]]
+
+
+class BM25Index:
+    """
+    Неизменяемый BM25 индекс в формате CSR
+
+    Инвертированная часть (поиск):
+    - vocab           - отсортированный словарь терминов (поиск по префиксу = бинарный поиск)
+    - offsets         - границы списка постингов каждого термина
+    - postings_docs   - номера чанков, postings_tfs - частота термина в чанке
+    - doc_lens, ids   - длина чанка в токенах и его ID в ChromaDB
+
+    Прямая часть (подсчёт совпадений):
+    - doc_term_offsets / doc_terms     - отсортированное множество токенов чанка
+    - doc_lemma_offsets / doc_lemmas   - отсортированное множество лемм чанка
+
+    Индекс лемм:
+    - lemma_vocab, term_lemmas         - словарь лемм и лемма каждой словоформы корпуса
+    - lemma_offsets / lemma_docs       - чанки, где встречается лемма (в любой форме)
+
+    Сопоставление терминов запроса (match):
+    - "lemma"  - все словоформы той же леммы: "Фирасту" находит "Фираст", "Фираста"
+    - "prefix" - слова, начинающиеся с термина (как прежний $contains, без скана)
+    - "exact"  - только та же словоформа
+    """
+
+    FILE_NAME = "keyword_index.npz"
+
+    ARRAYS = (
+        'ids', 'vocab', 'offsets', 'postings_docs', 'postings_tfs', 'doc_lens',
+        'doc_term_offsets', 'doc_terms', 'lemma_vocab', 'term_lemmas',
+        'doc_lemma_offsets', 'doc_lemmas', 'lemma_offsets', 'lemma_docs',
+    )
+
+    MATCH_MODES = ("lemma", "prefix", "exact")
+
+    def __init__(self, arrays: Dict[str, np.ndarray], k1: float = 1.5, b: float = 0.75):
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_len = float(self.doc_lens.mean()) if len(self.doc_lens) else 0.0
+        self._positions = None
+        self._lemma_terms = None  # лемма → словоформы (строится при первом обращении)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _vocab_id(self, term: str) -> Optional[int]:
+        """Номер словоформы в словаре (бинарный поиск)"""
+        i = int(np.searchsorted(self.vocab, term))
+        return i if i < len(self.vocab) and self.vocab[i] == term else None
+
+    def _lemma_id(self, term: str) -> Optional[int]:
+        """Лемма словоформы: из словаря корпуса, для новых слов - через лемматизатор"""
+        i = self._vocab_id(term)
+        if i is not None:
+            return int(self.term_lemmas[i])
+        lemma = get_lemmatizer().lemmatize(term)
+        j = int(np.searchsorted(self.lemma_vocab, lemma))
+        return j if j < len(self.lemma_vocab) and self.lemma_vocab[j] == lemma else None
+
+    def _lemma_term_ids(self, lemma_id: int) -> np.ndarray:
+        if self._lemma_terms is None:
+            order = np.argsort(self.term_lemmas, kind='stable')
+            bounds = np.zeros(len(self.lemma_vocab) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.term_lemmas, minlength=len(self.lemma_vocab)), out=bounds[1:])
+            self._lemma_terms = (bounds, order)
+        bounds, order = self._lemma_terms
+        return order[bounds[lemma_id]:bounds[lemma_id + 1]]
+
+    def _term_ids(self, term: str, match: str) -> np.ndarray:
+        """Словоформы словаря, с которыми сопоставляется термин запроса"""
+        if match not in self.MATCH_MODES:
+            raise ValueError(f"Unknown match mode: {match} (expected one of {self.MATCH_MODES})")
+        if match == "lemma":
+            lemma_id = self._lemma_id(term)
+            if lemma_id is not None:
+                return self._lemma_term_ids(lemma_id)
+            match = "prefix"  # слова нет в корпусе ни в какой форме - хотя бы по префиксу
+        if match == "prefix":
+            lo = int(np.searchsorted(self.vocab, term, side='left'))
+            hi = int(np.searchsorted(self.vocab, term + '\uffff', side='left'))
+            return np.arange(lo, hi)
+        i = self._vocab_id(term)
+        return np.arange(0) if i is None else np.array([i])
+
+    def term_postings(self, term: str, match: str = "lemma") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Постинги термина (все сопоставленные словоформы объединены)
+
+        Returns:
+            (номера чанков, суммарная частота в каждом)
+        """
+        term_ids = self._term_ids(term, match)
+        if not len(term_ids):
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        if len(term_ids) == 1 or np.all(np.diff(term_ids) == 1):
+            # Непрерывный диапазон словаря (точная форма или префикс) - один срез
+            start, end = self.offsets[term_ids[0]], self.offsets[term_ids[-1] + 1]
+            docs = self.postings_docs[start:end]
+            tfs = self.postings_tfs[start:end]
+        else:
+            docs = np.concatenate([_csr_row(self.offsets, self.postings_docs, i) for i in term_ids])
+            tfs = np.concatenate([_csr_row(self.offsets, self.postings_tfs, i) for i in term_ids])
+        if len(term_ids) > 1:
+            docs, inverse = np.unique(docs, return_inverse=True)
+            tfs = np.bincount(inverse, weights=tfs)
+        return docs, tfs.astype(np.float32)
+
+    def search(self, query: Union[str, Sequence[str]], k: int = 10,
+               match: str = "lemma") -> List[Tuple[str, float]]:
+        """
+        BM25 поиск
+
+        Args:
+            query: строка запроса или готовый список терминов
+            k: сколько чанков вернуть
+            match: "lemma", "prefix" или "exact" (см. описание класса)
+        Returns:
+            [(chunk_id, score)] по убыванию score
+        """
+        terms = tokenize(query) if isinstance(query, str) else [normalize_text(t) for t in query]
+        if not terms or not len(self.ids):
+            return []
+
+        n_docs = len(self.ids)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for term in dict.fromkeys(terms):
+            docs, tfs = self.term_postings(term, match)
+            if not len(docs):
+                continue
+            idf = math.log(1.0 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_lens[docs] / self.avg_doc_len)
+            scores[docs] += idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind='stable')]
+        return [(str(self.ids[i]), float(scores[i])) for i in matched]
+
+    def lemma(self, word: str) -> str:
+        """Лемма слова (как она записана в индексе)"""
+        tokens = tokenize(word)
+        if not tokens:
+            return normalize_text(word)
+        lemma_id = self._lemma_id(tokens[0])
+        return str(self.lemma_vocab[lemma_id]) if lemma_id is not None else get_lemmatizer().lemmatize(tokens[0])
+
+    def surface_forms(self, word: str) -> List[str]:
+        """Все словоформы корпуса с той же леммой ("Фирасту" → ["фираст", "фираста", ...])"""
+        tokens = tokenize(word)
+        lemma_id = self._lemma_id(tokens[0]) if tokens else None
+        if lemma_id is None:
+            return []
+        return [str(self.vocab[i]) for i in self._lemma_term_ids(lemma_id)]
+
+    def lemma_chunks(self, word: str) -> List[str]:
+        """ID чанков, где слово встречается в любой форме"""
+        tokens = tokenize(word)
+        lemma_id = self._lemma_id(tokens[0]) if tokens else None
+        if lemma_id is None:
+            return []
+        return [str(self.ids[i]) for i in _csr_row(self.lemma_offsets, self.lemma_docs, lemma_id)]
+
+    def position(self, chunk_id: str) -> Optional[int]:
+        """Номер чанка в индексе по его ID"""
+        if self._positions is None:
+            self._positions = {str(chunk_id): i for i, chunk_id in enumerate(self.ids)}
+        return self._positions.get(chunk_id)
+
+    def lemma_ids(self, keywords: Iterable[str]) -> np.ndarray:
+        """Ключевые слова → отсортированные ID их лемм (слова, которых нет в корпусе, отбрасываются)"""
+        found = {self._lemma_id(token) for keyword in keywords for token in tokenize(keyword)}
+        found.discard(None)
+        return np.array(sorted(found), dtype=np.int32)
+
+    def chunk_tokens(self, chunk_id: str) -> List[str]:
+        """Множество нормализованных токенов чанка"""
+        row = self.position(chunk_id)
+        if row is None:
+            return []
+        return [str(t) for t in self.vocab[_csr_row(self.doc_term_offsets, self.doc_terms, row)]]
+
+    def count_matches(self, chunk_ids: Sequence[str], keywords: Iterable[str]) -> List[int]:
+        """
+        Сколько ключевых слов встречается в каждом чанке (в любой форме)
+
+        Пересечение отсортированного множества лемм чанка с леммами запроса -
+        без lower()/поиска подстроки по тексту чанка.
+        """
+        query = self.lemma_ids(keywords)
+        counts = []
+        for chunk_id in chunk_ids:
+            row = self.position(chunk_id)
+            if row is None or not len(query):
+                counts.append(0)
+                continue
+            doc_lemmas = _csr_row(self.doc_lemma_offsets, self.doc_lemmas, row)
+            counts.append(int(np.count_nonzero(np.isin(query, doc_lemmas, assume_unique=True))))
+        return counts
+
+    def save(self, db_path: str):
+        """Атомарная запись в <db_path>/keyword_index.npz"""
+        path = Path(db_path) / self.FILE_NAME
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                params=np.array([self.k1, self.b]),
+                format=np.array(INDEX_FORMAT),
+                **{name: getattr(self, name) for name in self.ARRAYS}
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, db_path: str) -> Optional['BM25Index']:
+        """Загрузка индекса базы (None - индекса нет или он старого формата)"""
+        path = Path(db_path) / cls.FILE_NAME
+        if not path.exists():
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            if 'format' not in data.files or int(data['format']) != INDEX_FORMAT:
+                return None
+            k1, b = data['params']
+            return cls({name: data[name] for name in cls.ARRAYS}, k1=float(k1), b=float(b))
+
+
+class BM25Builder:
+    """Потоковая сборка BM25Index: чанки добавляются по одному во время ingestion"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: List[str] = []
+        self.term_ids = {}
+        self.doc_terms: List[np.ndarray] = []
+        self.doc_tfs: List[np.ndarray] = []
+        self.doc_lens: List[int] = []
+
+    def add(self, chunk_id: str, text: str):
+        counts = Counter(tokenize(text))
+        terms = np.fromiter(
+            (self.term_ids.setdefault(t, len(self.term_ids)) for t in counts),
+            dtype=np.int32, count=len(counts)
+        )
+        self.ids.append(chunk_id)
+        self.doc_terms.append(terms)
+        self.doc_tfs.append(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        self.doc_lens.append(sum(counts.values()))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def build(self) -> BM25Index:
+        # Словарь в алфавитном порядке - для бинарного поиска по префиксу
+        words = list(self.term_ids)
+        order = sorted(range(len(words)), key=words.__getitem__)
+        vocab = np.array([words[i] for i in order], dtype=str)
+        remap = np.empty(len(words), dtype=np.int32)
+        remap[order] = np.arange(len(words), dtype=np.int32)
+
+        # Леммы: словарь лемм и лемма каждой словоформы (каждая форма разбирается один раз)
+        lemmatizer = get_lemmatizer()
+        lemmas = [lemmatizer.lemmatize(words[i]) for i in order]
+        lemma_vocab = np.array(sorted(set(lemmas)), dtype=str)
+        term_lemmas = np.searchsorted(lemma_vocab, np.array(lemmas, dtype=str)).astype(np.int32)
+
+        doc_sizes = np.array([len(t) for t in self.doc_terms], dtype=np.int64)
+        if self.doc_terms:
+            terms = remap[np.concatenate(self.doc_terms)]
+            tfs = np.concatenate(self.doc_tfs)
+            docs = np.repeat(np.arange(len(self.ids), dtype=np.int32), doc_sizes)
+        else:
+            terms = np.empty(0, dtype=np.int32)
+            tfs = np.empty(0, dtype=np.float32)
+            docs = np.empty(0, dtype=np.int32)
+
+        # Группировка постингов по термину (внутри термина чанки по возрастанию)
+        by_term = np.argsort(terms, kind='stable')
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocab)), out=offsets[1:])
+
+        # Прямой индекс: отсортированные множества токенов и лемм каждого чанка
+        doc_term_offsets = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        np.cumsum(doc_sizes, out=doc_term_offsets[1:])
+        doc_terms = terms[np.lexsort((terms, docs))]
+
+        lemma_rows = [
+            np.unique(term_lemmas[_csr_row(doc_term_offsets, doc_terms, row)])
+            for row in range(len(self.ids))
+        ]
+        doc_lemma_offsets = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        np.cumsum([len(row) for row in lemma_rows], out=doc_lemma_offsets[1:])
+        doc_lemmas = np.concatenate(lemma_rows).astype(np.int32) if lemma_rows else np.empty(0, dtype=np.int32)
+
+        # Лемма → чанки (инверсия прямого индекса лемм)
+        lemma_owner = np.repeat(np.arange(len(self.ids), dtype=np.int32), np.diff(doc_lemma_offsets))
+        by_lemma = np.argsort(doc_lemmas, kind='stable')
+        lemma_offsets = np.zeros(len(lemma_vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(doc_lemmas, minlength=len(lemma_vocab)), out=lemma_offsets[1:])
+
+        return BM25Index({
+            'ids': np.array(self.ids, dtype=str),
+            'vocab': vocab,
+            'offsets': offsets,
+            'postings_docs': docs[by_term],
+            'postings_tfs': tfs[by_term],
+            'doc_lens': np.array(self.doc_lens, dtype=np.float32),
+            'doc_term_offsets': doc_term_offsets,
+            'doc_terms': doc_terms,
+            'lemma_vocab': lemma_vocab,
+            'term_lemmas': term_lemmas,
+            'doc_lemma_offsets': doc_lemma_offsets,
+            'doc_lemmas': doc_lemmas,
+            'lemma_offsets': lemma_offsets,
+            'lemma_docs': lemma_owner[by_lemma],
+        }, k1=self.k1, b=self.b)
+
+
+def iter_indexed(chunks: Iterable[Tuple[str, object]], builder: BM25Builder) -> Iterator[Tuple[str, object]]:
+    """Пропускает поток (chunk_id, document) дальше, попутно добавляя чанки в индекс"""
+    for chunk_id, doc in chunks:
+        builder.add(chunk_id, doc.page_content)
+        yield chunk_id, doc
@@ -7,7 +7,7 @@ RAG Knowledge Base System
 import os
 import sys
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional, Tuple
 import warnings
 warnings.filterwarnings('ignore')
 import logging
@@ -28,8 +28,51 @@ from langchain_community.llms import LlamaCpp
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 from langchain_community.llms import Ollama
+from langchain.docstore.document import Document
 from openai import OpenAI
 
+from rag_keyword_index import BM25Builder, BM25Index, iter_indexed
+from rag_retrieval import distance_to_similarity, fuse_rankings
+from rag_chroma import (
+    collection_hnsw,
+    forget_collection,
+    hnsw_configuration,
+    open_vectorstore,
+    query_collection,
+)
+from rag_exact_search import ExactIndex
+from rag_embeddings import (
+    CachedQueryEmbeddings,
+    ConcurrencyLimitedEmbeddings,
+    DiskEmbeddingCache,
+    check_embedding_parity,
+    configure_torch_threads,
+    create_backend_embeddings,
+    detect_device,
+    embedding_model_key,
+    get_query_embedding_cache,
+    LengthBucketedEmbeddings,
+    normalize_query,
+    ProcessPoolEmbeddings,
+)
+from rag_result_cache import get_result_cache, index_version
+from rag_ingestion import (
+    DEFAULT_WINDOW_SIZE,
+    IngestCheckpoint,
+    IngestionPipeline,
+    chunk_metadata,
+    fetch_collection_metadatas,
+    iter_batches,
+    iter_text_spans,
+    iter_with_chunk_ids,
+    read_source_span,
+    write_batch,
+)
+
+# Движки векторного поиска: HNSW ChromaDB или точный перебор (rag_exact_search)
+VECTOR_ENGINES = ("chroma", "exact")
+
+
 class LocalRAG:
     def __init__(
         self,
@@ -37,7 +80,25 @@ class LocalRAG:
         db_path: str = "chroma_db",
         embedding_model: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
         lm_studio_port: int = 1234,
-        use_gpu: bool = True
+        use_gpu: bool = True,
+        embedding_cache_dir: Optional[str] = None,
+        embed_batch_size: int = 32,
+        max_seq_length: Optional[int] = None,
+        embedding_workers: int = 0,
+        threads_per_worker: Optional[int] = None,
+        embedding_backend: str = "torch",
+        onnx_model_dir: Optional[str] = None,
+        verify_backend_parity: bool = True,
+        torch_threads: Optional[int] = None,
+        torch_interop_threads: Optional[int] = None,
+        max_concurrent_embeddings: int = 1,
+        vector_engine: str = "chroma",
+        hnsw_m: Optional[int] = None,
+        hnsw_ef_construction: Optional[int] = None,
+        hnsw_ef_search: Optional[int] = None,
+        query_cache_size: int = 1024,
+        result_cache_size: int = 256,
+        result_cache_ttl: float = 600.0
     ):
         """
         Инициализация RAG системы
@@ -47,71 +108,641 @@ class LocalRAG:
             db_path: путь для сохранения векторной БД
             embedding_model: модель для embeddings
             lm_studio_port: порт LM Studio (по умолчанию 1234)
-            use_gpu: использовать GPU для embeddings
+            use_gpu: использовать GPU для embeddings (если CUDA нет - CPU)
+            embedding_cache_dir: папка дискового кэша embeddings (None - без кэша)
+            embed_batch_size: размер батча при векторизации документов
+                (бюджет токенов = embed_batch_size x max_seq_length)
+            max_seq_length: макс. длина чанка в токенах (None - по умолчанию модели)
+            embedding_workers: >0 - векторизация документов в N процессах на CPU
+                (для сборки базы на серверах без GPU)
+            threads_per_worker: потоков torch на процесс (None - cpu_count // N)
+            embedding_backend: "torch" (fp32, по умолчанию), "onnx", "onnx-int8" или "int8"
+                (квантованные/ONNX бэкенды - только CPU, быстрее на серверах без GPU)
+            onnx_model_dir: куда сохранять экспортированные ONNX модели
+                (None - <embedding_cache_dir>/onnx или onnx_models)
+            verify_backend_parity: сравнить векторы не-torch бэкенда с fp32 при загрузке
+            torch_threads: intra-op потоков torch (None - на CPU cpu_count // max_concurrent_embeddings)
+            torch_interop_threads: inter-op потоков torch (None - по умолчанию torch)
+            max_concurrent_embeddings: сколько запросов одновременно векторизуются моделью,
+                остальные ждут (без переподписки ядер при параллельных запросах Gradio)
+            vector_engine: "chroma" (HNSW, по умолчанию) или "exact" - точный перебор по
+                memory-mapped float16 матрице (rag_exact_search), ChromaDB остаётся хранилищем текстов
+            hnsw_m: M графа HNSW (None - 16, по умолчанию ChromaDB)
+            hnsw_ef_construction: ef_construction HNSW (None - 100)
+            hnsw_ef_search: ef_search коллекции (None - 100); на запрос поднимается
+                параметром ef_search у vector_search/fused_search/ретривера
+                (все три применяются только при создании базы)
+            query_cache_size: сколько векторов запросов держит общий для процесса LRU
+                (0 - без кэша запросов)
+            result_cache_size: сколько результатов инструментов поиска держит общий кэш
+                (0 - без кэша результатов)
+            result_cache_ttl: срок жизни результата в кэше, секунд
         """
+        if vector_engine not in VECTOR_ENGINES:
+            raise ValueError(f"Unknown vector engine: {vector_engine} (expected one of {list(VECTOR_ENGINES)})")
         self.text_file_path = text_file_path
         self.db_path = db_path
+        self.embedding_model = embedding_model
         self.lm_studio_port = lm_studio_port
+        self.vector_engine = vector_engine
+        self.hnsw_config = hnsw_configuration(hnsw_m, hnsw_ef_construction, hnsw_ef_search)
 
         # Настройка embedding модели
         print(f"Loading embedding model: {embedding_model}...")
-        model_kwargs = {'device': 'cuda'} if use_gpu else {'device': 'cpu'}
-        encode_kwargs = {'normalize_embeddings': True}
-
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=embedding_model,
-            model_kwargs=model_kwargs,
-            encode_kwargs=encode_kwargs
+        device = detect_device(prefer_gpu=use_gpu)
+        if device == 'cpu' and torch_threads is None and max_concurrent_embeddings > 1:
+            # Параллельные запросы делят ядра поровну
+            torch_threads = max(1, (os.cpu_count() or 1) // max_concurrent_embeddings)
+        if torch_threads or torch_interop_threads:
+            intra, inter = configure_torch_threads(torch_threads, torch_interop_threads)
+            print(f"Torch threads: {intra} intra-op, {inter} inter-op")
+        self.device = device
+        encode_kwargs = {'normalize_embeddings': True, 'batch_size': embed_batch_size}
+        if onnx_model_dir is None:
+            onnx_model_dir = os.path.join(embedding_cache_dir, "onnx") if embedding_cache_dir else "onnx_models"
+        self.embedding_backend = embedding_backend
+
+        self.embeddings = create_backend_embeddings(
+            embedding_model,
+            backend=embedding_backend,
+            device=device,
+            encode_kwargs=encode_kwargs,
+            onnx_dir=onnx_model_dir,
+            verify_parity=verify_backend_parity
         )
+        if max_seq_length:
+            # Та же обрезка, что у документов в пуле процессов: запросы векторизуются этой моделью
+            self.embeddings.client.max_seq_length = max_seq_length
+        # Сама модель без обёрток (для проверки паритета с векторами базы)
+        self.base_embeddings = self.embeddings
+
+        if embedding_workers > 0:
+            # Шардированная векторизация: N процессов со своей копией модели
+            print(f"Embedding pool: {embedding_workers} CPU workers")
+            self.embeddings = ProcessPoolEmbeddings(
+                self.embeddings,
+                model_name=embedding_model,
+                num_workers=embedding_workers,
+                threads_per_worker=threads_per_worker,
+                batch_size=embed_batch_size,
+                max_seq_length=max_seq_length,
+                encode_kwargs=encode_kwargs,
+                backend=embedding_backend,
+                onnx_dir=onnx_model_dir
+            )
+        else:
+            # Батчи по длине в токенах для ingestion (меньше паддинга на CPU)
+            self.embeddings = LengthBucketedEmbeddings(
+                self.embeddings,
+                batch_size=embed_batch_size,
+                max_seq_length=max_seq_length
+            )
+
+        # Дисковый кэш: одинаковый текст этой моделью (бэкенд, max_seq_length) не векторизуется повторно
+        model_key = embedding_model_key(embedding_model, embedding_backend, max_seq_length)
+        self.embedding_cache = None
+        if embedding_cache_dir:
+            self.embeddings = self.embedding_cache = DiskEmbeddingCache(
+                self.embeddings, model_key, embedding_cache_dir
+            )
+            print(f"Embedding cache: {self.embedding_cache.cache_path}")
+
+        # Очередь к модели: не больше max_concurrent_embeddings вызовов одновременно
+        self.embeddings = ConcurrencyLimitedEmbeddings(self.embeddings, max_concurrent_embeddings)
+
+        # Повторные запросы (агент, hybrid_search, ретривер) не векторизуются заново;
+        # кэш общий для всех LocalRAG процесса, ключ - модель + бэкенд + max_seq_length + запрос
+        self.query_cache = None
+        if query_cache_size > 0:
+            self.query_cache = get_query_embedding_cache(query_cache_size)
+            self.embeddings = CachedQueryEmbeddings(
+                self.embeddings, model_key, self.query_cache
+            )
+
+        # Результаты hybrid_search / rag_semantic_search / grep_search (TTL + LRU,
+        # сбрасываются при изменении базы или текстового файла)
+        self.result_cache = get_result_cache(result_cache_size, result_cache_ttl) if result_cache_size > 0 else None
 
         self.vectorstore = None
+        self._vectorstore_path = None
         self.qa_chain = None
+        self.keyword_index = None
+        self.exact_index = None
 
     def load_and_split_documents(self, chunk_size: int = 1000, chunk_overlap: int = 200):
         """Загрузка и разбиение документа на чанки"""
         print(f"\nLoading document: {self.text_file_path}")
 
-        # Загрузка текста
-        loader = TextLoader(self.text_file_path, encoding='utf-8')
-        documents = loader.load()
+        # Весь файл одним окном - те же чанки, что и у RecursiveCharacterTextSplitter
+        # по целому документу, плюс координаты каждого чанка в файле
+        window_size = max(DEFAULT_WINDOW_SIZE, os.path.getsize(self.text_file_path) + chunk_size + 1)
+        splits = list(self.iter_split_documents(chunk_size, chunk_overlap, window_size=window_size))
+        print(f"Document split into {len(splits)} chunks")
+
+        return splits
+
+    def iter_split_documents(
+        self,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        window_size: int = DEFAULT_WINDOW_SIZE
+    ) -> Iterator[Document]:
+        """
+        Потоковое разбиение документа на чанки (генератор)
+
+        Файл читается окнами по window_size символов, чанки отдаются по одному -
+        пиковая память не зависит от размера корпуса. Параметры chunk_size/chunk_overlap
+        те же, что и у load_and_split_documents.
 
-        print(f"Document loaded. Length: {len(documents[0].page_content)} characters")
+        Метаданные чанка: source, chunk_index, start_byte/end_byte, start_line/end_line
+        (см. read_chunk_source / get_neighbor_chunks / chunks_for_line).
+        """
+        print(f"\nStreaming document: {self.text_file_path} (window: {window_size} chars)")
 
-        # Разбиение на чанки
-        text_splitter = RecursiveCharacterTextSplitter(
+        spans = iter_text_spans(
+            self.text_file_path,
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""]
+            window_size=window_size
         )
+        for chunk_index, span in enumerate(spans):
+            yield Document(
+                page_content=span.text,
+                metadata=chunk_metadata(self.text_file_path, chunk_index, span)
+            )
 
-        splits = text_splitter.split_documents(documents)
-        print(f"Document split into {len(splits)} chunks")
-
-        return splits
+    def create_vectorstore(self, documents: Iterable, force_recreate: bool = False, batch_size: int = 256):
+        """
+        Создание векторного хранилища
 
-    def create_vectorstore(self, documents: List, force_recreate: bool = False):
-        """Создание векторного хранилища"""
+        Args:
+            documents: список чанков ИЛИ генератор из iter_split_documents()
+            force_recreate: пересоздать базу с нуля
+            batch_size: сколько чанков векторизуется и пишется в ChromaDB за раз
+        """
 
         if os.path.exists(self.db_path) and not force_recreate:
             print(f"\nLoading existing vector database from {self.db_path}...")
-            self.vectorstore = Chroma(
-                persist_directory=self.db_path,
-                embedding_function=self.embeddings
-            )
+            self.load_vectorstore()
             print(f"Vector database loaded. Contains {self.vectorstore._collection.count()} documents")
         else:
             print(f"\nCreating new vector database...")
-            self.vectorstore = Chroma.from_documents(
-                documents=documents,
-                embedding=self.embeddings,
-                persist_directory=self.db_path
-            )
-            print(f"Vector database created with {len(documents)} documents")
+            self.load_vectorstore()
+            if force_recreate and self.vectorstore._collection.count() > 0:
+                # Иначе новые чанки добавятся к старым (дубликаты)
+                print("Removing old collection...")
+                self.vectorstore.delete_collection()
+                forget_collection(self.db_path)
+                self.vectorstore = None
+                self.keyword_index = None
+                self.load_vectorstore()
+                self._invalidate_exact_index()
+
+            # Чанки идут в embedding батчами прямо из генератора - весь список не нужен.
+            # BM25 индекс собирается по тому же потоку
+            builder = BM25Builder()
+            total = self._embed_and_write(iter_indexed(iter_with_chunk_ids(documents), builder), batch_size)
+            self._save_keyword_index(builder)
+            self._invalidate_exact_index()
+
+            print(f"\nVector database created with {total} documents")
             print(f"Saved to: {self.db_path}")
 
         return self.vectorstore
 
+    def load_vectorstore(self):
+        """
+        Подключение к базе db_path через общий реестр коллекций (rag_chroma)
+
+        Клиент и коллекция открываются один раз на процесс; повторный вызов
+        для той же базы ничего не переоткрывает.
+        """
+        if self.vectorstore is None or self._vectorstore_path != self.db_path:
+            self.vectorstore = open_vectorstore(self.db_path, self.embeddings, configuration=self.hnsw_config)
+            self._vectorstore_path = self.db_path
+            self._report_hnsw()
+            self.keyword_index = None
+            self.exact_index = None
+            if self.vector_engine == "exact" and self.vectorstore._collection.count() > 0:
+                self.load_exact_index()
+        return self.vectorstore
+
+    def _report_hnsw(self):
+        """Фактические настройки HNSW базы (запрошенные действуют только при создании)"""
+        actual = collection_hnsw(self.vectorstore._collection)
+        if not actual:
+            return
+        print(f"HNSW: M={actual.get('max_neighbors')}, ef_construction={actual.get('ef_construction')}, "
+              f"ef_search={actual.get('ef_search')}")
+        requested = (self.hnsw_config or {}).get('hnsw', {})
+        differs = {key: value for key, value in requested.items() if actual.get(key) != value}
+        if differs and self.vectorstore._collection.count() > 0:
+            print(f"⚠️ HNSW settings {differs} not applied: existing collection keeps its build-time "
+                  f"settings (rebuild with force_recreate=True)")
+
+    def _embed_and_write(self, chunks: Iterable, batch_size: int, on_written=None) -> int:
+        """
+        Векторизация потока (chunk_id, document) и запись в ChromaDB
+
+        Чтение/разбиение, embedding и запись идут конвейером (IngestionPipeline)
+        с ограниченными очередями; пропускная способность стадий печатается по ходу.
+
+        Args:
+            chunks: поток (chunk_id, document)
+            batch_size: размер батча
+            on_written: вызывается с батчем после его записи в ChromaDB
+
+        Returns:
+            количество записанных чанков
+        """
+        collection = self.vectorstore._collection
+
+        def write(batch, vectors):
+            write_batch(collection, batch, vectors)
+            if on_written is not None:
+                on_written(batch)
+
+        pipeline = IngestionPipeline(self.embeddings, write_fn=write, batch_size=batch_size)
+        return pipeline.run(chunks)
+
+    def sync_vectorstore(self, documents: Iterable, batch_size: int = 256):
+        """
+        Инкрементальная переиндексация вместо force_recreate
+
+        ID чанка = хэш его содержимого (см. rag_ingestion.chunk_id), поэтому:
+        - чанки, которые уже есть в базе, НЕ векторизуются повторно
+        - новые/изменённые чанки векторизуются и добавляются
+        - чанки, исчезнувшие из текста, удаляются из базы
+        - прерванная сборка продолжается с контрольной точки (ingest_checkpoint.json)
+
+        Правка одного абзаца в cosmic_texts.txt стоит секунды, а не полной пересборки.
+
+        Args:
+            documents: список чанков или генератор из iter_split_documents()
+            batch_size: размер батча для embedding
+        """
+        print(f"\nSyncing vector database: {self.db_path}")
+        self.load_vectorstore()
+        collection = self.vectorstore._collection
+
+        existing_metadatas = fetch_collection_metadatas(collection)
+        existing_ids = set(existing_metadatas)
+        print(f"Existing chunks in database: {len(existing_ids)}")
+
+        # Контрольная точка: прерванная сборка продолжается с последнего записанного чанка
+        checkpoint = IngestCheckpoint(self.db_path, self._ingest_signature())
+        resume = checkpoint.load()
+        resume_position = resume['position'] if resume else 0
+        if resume:
+            print(f"Resuming interrupted build from chunk {resume_position} "
+                  f"(checkpoint {resume['updated']})")
+
+        seen_ids = set()
+        positions = {}        # chunk_id → позиция в потоке (для ещё не записанных)
+        moved = []            # (chunk_id, metadata) чанков, которые есть в базе, но сдвинулись в файле
+        verified = [0, 0]     # [найдено в базе, проверено] для диапазона до контрольной точки
+        state = {'position': resume_position, 'last_id': resume['last_chunk_id'] if resume else None, 'written': 0}
+
+        # BM25 индекс пересобирается по всему потоку чанков (включая неизменённые)
+        builder = BM25Builder()
+
+        def new_chunks():
+            for position, (chunk_id, doc) in enumerate(iter_indexed(iter_with_chunk_ids(documents), builder)):
+                seen_ids.add(chunk_id)
+                in_db = chunk_id in existing_ids
+
+                if position < resume_position:
+                    # Уже записанный диапазон: только проверка по ID, без embedding
+                    verified[0] += in_db
+                    verified[1] += 1
+                    if position == resume_position - 1 and chunk_id != resume['last_chunk_id']:
+                        print(f"\n⚠️ Checkpoint mismatch at chunk {position}: text changed since interruption")
+
+                if not in_db:
+                    positions[chunk_id] = position
+                    yield chunk_id, doc
+                elif existing_metadatas[chunk_id] != doc.metadata:
+                    # Тот же текст, другое место (правка выше по файлу): только метаданные
+                    moved.append((chunk_id, doc.metadata))
+
+        def on_written(batch):
+            # Конвейер пишет батчи по порядку: всё до последнего чанка батча уже в базе
+            last_id = batch[-1][0]
+            state['position'] = positions[last_id] + 1
+            state['last_id'] = last_id
+            state['written'] += len(batch)
+            for chunk_id, _ in batch:
+                positions.pop(chunk_id, None)
+            checkpoint.save(state['position'], last_id, state['written'])
+
+        try:
+            added = self._embed_and_write(new_chunks(), batch_size, on_written=on_written)
+        except BaseException:
+            # Прерывание (Ctrl+C, ошибка): фиксируем точную позицию перед выходом
+            if state['last_id'] is not None:
+                checkpoint.save(state['position'], state['last_id'], state['written'], force=True)
+            print(f"\nBuild interrupted. Checkpoint saved at chunk {state['position']}")
+            raise
+
+        if resume:
+            found, checked = verified
+            status = "OK" if found == checked else f"{checked - found} missing, re-embedded"
+            print(f"\nCheckpoint range verified: {found}/{checked} chunk IDs present ({status})")
+
+        # Координаты неизменённых чанков, сдвинутых правками выше по файлу
+        for batch in iter_batches(moved, 5000):
+            collection.update(
+                ids=[chunk_id for chunk_id, _ in batch],
+                metadatas=[metadata for _, metadata in batch]
+            )
+
+        # Удаляем чанки, которых больше нет в тексте
+        vanished = existing_ids - seen_ids
+        for batch in iter_batches(sorted(vanished), 5000):
+            collection.delete(ids=batch)
+
+        self._save_keyword_index(builder)
+        if added or vanished:
+            self._invalidate_exact_index()
+        checkpoint.save(len(seen_ids), state['last_id'], state['written'], complete=True, force=True)
+
+        unchanged = len(seen_ids) - added
+        print(f"\nSync complete: {added} added, {len(vanished)} deleted, {unchanged} unchanged "
+              f"({len(moved)} moved)")
+        print(f"Total chunks: {collection.count()}")
+        if self.embedding_cache is not None:
+            stats = self.embedding_cache.stats()
+            print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses")
+
+        return self.vectorstore
+
+    def _save_keyword_index(self, builder: BM25Builder):
+        """Сборка и запись BM25 индекса рядом с векторами (<db_path>/keyword_index.npz)"""
+        self.keyword_index = builder.build()
+        self.keyword_index.save(self.db_path)
+        print(f"Keyword index: {len(self.keyword_index)} chunks, {len(self.keyword_index.vocab)} terms")
+
+    def build_keyword_index(self, page_size: int = 5000) -> BM25Index:
+        """BM25 индекс по уже собранной коллекции (для баз, созданных до появления индекса)"""
+        print(f"Building keyword index from {self.db_path}...")
+        collection = self.vectorstore._collection
+        builder = BM25Builder()
+        offset = 0
+        while True:
+            page = collection.get(include=['documents'], limit=page_size, offset=offset)
+            if not page['ids']:
+                break
+            for chunk_id, text in zip(page['ids'], page['documents']):
+                builder.add(chunk_id, text)
+            offset += len(page['ids'])
+        self._save_keyword_index(builder)
+        return self.keyword_index
+
+    def load_keyword_index(self) -> BM25Index:
+        """
+        BM25 индекс базы: из памяти, с диска или (если его нет/устарел) сборка по коллекции
+
+        Устаревший индекс = число чанков в нём не совпадает с коллекцией
+        (база изменена без sync_vectorstore).
+        """
+        count = self.vectorstore._collection.count()
+        if self.keyword_index is None:
+            self.keyword_index = BM25Index.load(self.db_path)
+        if self.keyword_index is None or len(self.keyword_index) != count:
+            self.build_keyword_index()
+        return self.keyword_index
+
+    def build_exact_index(self, page_size: int = 5000) -> ExactIndex:
+        """Выгрузка векторов коллекции в memory-mapped матрицу (<db_path>/exact_index/)"""
+        print(f"Building exact vector index from {self.db_path}...")
+        self.exact_index = ExactIndex.build(self.vectorstore._collection, self.db_path, page_size=page_size)
+        self.vectorstore.exact_index = self.exact_index
+        size_mb = self.exact_index.matrix.nbytes / 1024 / 1024
+        print(f"Exact index: {len(self.exact_index)} vectors x {self.exact_index.dim} (float16, {size_mb:.0f} MB)")
+        return self.exact_index
+
+    def load_exact_index(self) -> ExactIndex:
+        """
+        Точный индекс базы: из памяти, с диска или (если его нет/устарел) выгрузка из коллекции
+
+        Устаревший индекс = число векторов не совпадает с коллекцией.
+        """
+        count = self.vectorstore._collection.count()
+        if self.exact_index is None:
+            self.exact_index = ExactIndex.load(self.db_path)
+        if self.exact_index is None or len(self.exact_index) != count:
+            self.build_exact_index()
+        self.vectorstore.exact_index = self.exact_index
+        return self.exact_index
+
+    def _invalidate_exact_index(self):
+        """
+        После изменения коллекции: старая матрица удаляется, для engine="exact" - пересборка
+
+        Пустая коллекция (force_recreate до записи чанков) не выгружается: матрица
+        пишется только после ingestion.
+        """
+        self.exact_index = None
+        self.vectorstore.exact_index = None
+        ExactIndex.remove(self.db_path)
+        if self.vector_engine == "exact" and self.vectorstore._collection.count() > 0:
+            self.build_exact_index()
+
+    def _fetch_documents(self, ids: List[str]) -> dict:
+        """chunk_id → Document для указанных ID (одним запросом к коллекции)"""
+        if not ids:
+            return {}
+        result = self.vectorstore._collection.get(ids=list(ids), include=['documents', 'metadatas'])
+        return {
+            chunk_id: Document(id=chunk_id, page_content=text, metadata=meta or {})
+            for chunk_id, text, meta in zip(result['ids'], result['documents'], result['metadatas'])
+        }
+
+    def get_documents_by_ids(self, ids: List[str]) -> List[Document]:
+        """Чанки из коллекции по ID, в порядке ids"""
+        by_id = self._fetch_documents(ids)
+        return [by_id[chunk_id] for chunk_id in ids if chunk_id in by_id]
+
+    def vector_search(self, query: str, k: int = 10,
+                      ef_search: Optional[int] = None) -> List[Tuple[str, Document, float]]:
+        """
+        Векторный поиск с настоящими скорами
+
+        ef_search: усилие HNSW поиска для этого запроса (None - настройка коллекции);
+            больше - выше recall, дольше запрос. Для vector_engine="exact" не нужен
+
+        Returns:
+            [(chunk_id, document, косинусная близость)] по убыванию близости
+        """
+        collection = self.vectorstore._collection
+        if collection.count() == 0:
+            return []
+
+        if self.vector_engine == "exact":
+            hits = self.load_exact_index().search(self.embeddings.embed_query(query), k)
+            documents = self._fetch_documents([chunk_id for chunk_id, _ in hits])
+            return [(chunk_id, documents[chunk_id], score) for chunk_id, score in hits if chunk_id in documents]
+
+        space = (collection.metadata or {}).get('hnsw:space', 'l2')
+        result = query_collection(
+            collection,
+            [self.embeddings.embed_query(query)],
+            k,
+            ef_search=ef_search,
+            include=['documents', 'metadatas', 'distances']
+        )
+        return [
+            (chunk_id, Document(id=chunk_id, page_content=text, metadata=meta or {}),
+             distance_to_similarity(distance, space))
+            for chunk_id, text, meta, distance in zip(
+                result['ids'][0], result['documents'][0], result['metadatas'][0], result['distances'][0]
+            )
+        ]
+
+    def fused_search(
+        self,
+        query: str,
+        k: int = 10,
+        keywords: Optional[List[str]] = None,
+        fusion: str = "rrf",
+        keyword_weight: float = 1.0,
+        candidates: Optional[int] = None,
+        ef_search: Optional[int] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        Гибридный поиск: векторные и BM25 результаты сливаются по скорам
+
+        Из каждого источника берётся небольшой пул кандидатов (candidates, по умолчанию 2k),
+        затем RRF или взвешенная сумма (см. rag_retrieval) выбирает top-k.
+
+        Args:
+            query: поисковый запрос
+            k: количество документов
+            keywords: термины для BM25 (None - весь запрос, [] - без keyword поиска)
+            fusion: "rrf" или "weighted"
+            keyword_weight: вес keyword списка относительно векторного (1.0 - равные)
+            candidates: размер пула кандидатов из каждого источника
+            ef_search: усилие HNSW поиска векторной части (см. vector_search)
+
+        Returns:
+            [(document, fused score)] по убыванию score
+        """
+        candidates = candidates or k * 2
+
+        vector_hits = self.vector_search(query, k=candidates, ef_search=ef_search)
+        documents = {chunk_id: doc for chunk_id, doc, _ in vector_hits}
+        rankings = [[(chunk_id, score) for chunk_id, _, score in vector_hits]]
+        weights = [1.0]
+
+        if keywords is None or keywords:
+            keyword_query = query if keywords is None else keywords
+            rankings.append(self.load_keyword_index().search(keyword_query, k=candidates))
+            weights.append(keyword_weight)
+
+        fused = fuse_rankings(rankings, method=fusion, weights=weights)[:k]
+
+        # Чанки, найденные только по ключевым словам, догружаются по ID
+        documents.update(self._fetch_documents([chunk_id for chunk_id, _ in fused if chunk_id not in documents]))
+        return [(documents[chunk_id], score) for chunk_id, score in fused if chunk_id in documents]
+
+    def cached_result(self, tool: str, query: str, params: tuple, compute):
+        """
+        Результат инструмента поиска через общий кэш результатов
+
+        Ключ - (инструмент, база, нормализованный запрос, параметры: k, режим, ...),
+        запись действительна, пока не изменились файлы базы и текстовый файл.
+        Ошибки (исключение или ответ инструмента с ключом "error") не кэшируются.
+        """
+        if self.result_cache is None:
+            return compute()
+        key = (tool, os.path.abspath(self.db_path), normalize_query(query), params)
+        version = index_version(self.db_path, self.text_file_path)
+        found, result = self.result_cache.get(key, version)
+        if found:
+            logger.info(f"Result cache hit: {tool} '{query}'")
+            return result
+        result = compute()
+        if not (isinstance(result, dict) and 'error' in result):
+            self.result_cache.put(key, version, result)
+        return result
+
+    def _ingest_signature(self) -> dict:
+        """Сигнатура сборки для контрольной точки: текст + модель"""
+        stat = os.stat(self.text_file_path)
+        return {
+            'text_file': os.path.abspath(self.text_file_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'embedding_model': self.embedding_model
+        }
+
+    def read_chunk_source(self, metadata: dict) -> Optional[str]:
+        """
+        Текст чанка прямо из исходного файла по его координатам (seek, без сканирования)
+
+        None - чанк из базы, собранной до появления координат (нужен sync_vectorstore)
+        """
+        if 'start_byte' not in metadata:
+            return None
+        source = metadata.get('source') or self.text_file_path
+        return read_source_span(source, metadata['start_byte'], metadata['end_byte'])
+
+    def get_neighbor_chunks(self, metadata: dict, before: int = 1, after: int = 1) -> List[Document]:
+        """Соседние чанки (по chunk_index) вокруг найденного, включая его самого, по порядку"""
+        if self.vectorstore is None or 'chunk_index' not in metadata:
+            return []
+
+        index = metadata['chunk_index']
+        wanted = [i for i in range(index - before, index + after + 1) if i >= 0]
+        result = self.vectorstore._collection.get(
+            where={'chunk_index': {'$in': wanted}},
+            include=['documents', 'metadatas']
+        )
+        docs = [
+            Document(page_content=text, metadata=meta)
+            for text, meta in zip(result['documents'], result['metadatas'])
+        ]
+        return sorted(docs, key=lambda doc: doc.metadata['chunk_index'])
+
+    def chunks_for_line(self, line_num: int) -> List[Document]:
+        """Чанки, покрывающие строку line_num файла (связь grep_search → векторная база)"""
+        if self.vectorstore is None:
+            return []
+
+        result = self.vectorstore._collection.get(
+            where={'$and': [{'start_line': {'$lte': line_num}}, {'end_line': {'$gte': line_num}}]},
+            include=['documents', 'metadatas']
+        )
+        docs = [
+            Document(page_content=text, metadata=meta)
+            for text, meta in zip(result['documents'], result['metadatas'])
+        ]
+        return sorted(docs, key=lambda doc: doc.metadata['chunk_index'])
+
+    def verify_embedding_parity(self, sample_size: int = 32, min_cosine: Optional[float] = None) -> float:
+        """
+        Сравнение текущего бэкенда с векторами, уже сохранёнными в базе
+
+        Берёт sample_size чанков из коллекции, векторизует их заново моделью
+        (без дискового кэша) и проверяет косинус с сохранёнными векторами.
+        Полезно после смены embedding_backend на уже собранной базе.
+        """
+        if self.vectorstore is None:
+            raise ValueError("Vectorstore not loaded")
+
+        sample = self.vectorstore._collection.get(limit=sample_size, include=['documents', 'embeddings'])
+        if not sample['ids']:
+            print("Parity check skipped: database is empty")
+            return 1.0
+
+        candidate = self.base_embeddings.embed_documents(sample['documents'])
+        kwargs = {} if min_cosine is None else {'min_cosine': min_cosine}
+        return check_embedding_parity(
+            sample['embeddings'], candidate,
+            label=f"{self.embedding_backend} vs {os.path.basename(self.db_path)}",
+            **kwargs
+        )
+
     def setup_lm_studio_llm(self, model_name: str = "google/gemma-3-27b"):
         """
         Настройка LLM через LM Studio API (OpenAI-compatible)
@@ -131,13 +762,14 @@ class LocalRAG:
         self.model_name = model_name
         return self.llm_client
 
-    def create_qa_chain(self, retriever_k: int = 4, use_mmr: bool = True):
+    def create_qa_chain(self, retriever_k: int = 4, use_mmr: bool = True, ef_search: Optional[int] = None):
         """
         Создание цепочки для QA с поддержкой fuzzy search
 
         Args:
             retriever_k: количество документов для возврата
             use_mmr: использовать MMR для разнообразия результатов
+            ef_search: усилие HNSW поиска ретривера (None - настройка коллекции)
         """
 
         if self.vectorstore is None:
@@ -152,7 +784,8 @@ class LocalRAG:
                 search_kwargs={
                     "k": retriever_k,
                     "fetch_k": retriever_k * 3,  # Берем в 3 раза больше кандидатов
-                    "lambda_mult": 0.5  # Баланс между релевантностью и разнообразием
+                    "lambda_mult": 0.5,  # Баланс между релевантностью и разнообразием
+                    "ef_search": ef_search
                 }
             )
         else:
@@ -160,7 +793,8 @@ class LocalRAG:
                 search_type="similarity",
                 search_kwargs={
                     "k": retriever_k,
-                    "fetch_k": retriever_k * 2  # Больше кандидатов для similarity
+                    "fetch_k": retriever_k * 2,  # Больше кандидатов для similarity
+                    "ef_search": ef_search
                 }
             )
 
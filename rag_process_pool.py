@@ -0,0 +1,171 @@
+"""
+Пул процессов с собственной точкой входа (для regex grep rag_text_store)
+
+multiprocessing spawn (и forkserver) выполняет в каждом воркере модуль __main__
+родителя - у лаунчера это gradio, langchain, chromadb, rag_knowledge_base: ~5 с и
+~120 MB на воркер. Здесь воркер - отдельный процесс `python rag_process_pool.py`:
+он импортирует только модули переданных функций (~0.3 с, ~30 MB).
+
+Задачи и результаты передаются pickle через stdin/stdout воркера (print() в воркере
+уходит в stderr). Функция передаётся по имени, как у ProcessPoolExecutor, поэтому
+она должна быть в импортируемом модуле (не в __main__); sys.path воркера - как у родителя.
+"""
+
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
+
+
+class LightProcessPool(Executor):
+    """
+    Executor на N процессах `python rag_process_pool.py`
+
+    На каждый воркер - поток родителя, который берёт задачу из общей очереди,
+    отправляет её воркеру и ждёт ответ. Если воркер завершился, пул помечается
+    сломанным (как ProcessPoolExecutor): ожидающие задачи получают BrokenProcessPool.
+    """
+
+    def __init__(self, max_workers: int):
+        self._tasks: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._broken = None
+        self._shutdown = False
+
+        script = os.path.abspath(__file__)
+        self._processes: List[subprocess.Popen] = [
+            subprocess.Popen([sys.executable, script], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            for _ in range(max_workers)
+        ]
+        for process in self._processes:
+            pickle.dump(sys.path, process.stdin)
+            process.stdin.flush()
+        self._threads = [
+            threading.Thread(target=self._serve, args=(process,), daemon=True, name=f"LightProcessPool-{i}")
+            for i, process in enumerate(self._processes)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def broken(self) -> bool:
+        return self._broken is not None
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        with self._lock:
+            if self._broken:
+                raise BrokenProcessPool(self._broken)
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            future = Future()
+            self._tasks.put((future, fn, args, kwargs))
+            return future
+
+    def _serve(self, process: subprocess.Popen):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+            future, fn, args, kwargs = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                data = pickle.dumps((fn, args, kwargs))
+            except Exception as e:  # задача не сериализуется - воркер цел
+                future.set_exception(e)
+                continue
+            try:
+                pickle.dump(data, process.stdin)  # задача - bytes: воркер всегда дочитывает её целиком
+                process.stdin.flush()
+                ok, result = pickle.load(process.stdout)
+            except Exception as e:
+                self._break(f"Worker process {process.pid} terminated: {e!r}")
+                future.set_exception(BrokenProcessPool(self._broken))
+                self._close(process)
+                return
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+        self._close(process)
+
+    def _break(self, reason: str):
+        """Воркер умер: новые задачи не принимаются, ожидающие получают BrokenProcessPool"""
+        with self._lock:
+            if self._broken is None:
+                self._broken = reason
+            for future in self._take_queued():
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(BrokenProcessPool(self._broken))
+            for _ in self._threads:
+                self._tasks.put(None)
+
+    def _take_queued(self) -> List[Future]:
+        """Забрать из очереди ещё не начатые задачи"""
+        futures = []
+        while True:
+            try:
+                task = self._tasks.get_nowait()
+            except queue.Empty:
+                return futures
+            if task is not None:
+                futures.append(task[0])
+
+    @staticmethod
+    def _close(process: subprocess.Popen):
+        try:
+            process.stdin.close()  # воркер выходит по EOF
+        except OSError:
+            pass
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                for future in self._take_queued():
+                    future.cancel()
+            for _ in self._threads:
+                self._tasks.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+            for process in self._processes:
+                self._close(process)
+                process.wait()
+
+
+def _worker_main():
+    """Цикл воркера: pickle (функция, args, kwargs) из stdin → (успех, результат) в stdout"""
+    tasks = sys.stdin.buffer
+    sys.path[:] = pickle.load(tasks)
+    results = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())  # print() задач не портит протокол
+    sys.stdout = sys.stderr
+    while True:
+        try:
+            task = pickle.load(tasks)
+        except EOFError:
+            return
+        try:
+            fn, args, kwargs = pickle.loads(task)
+            reply = (True, fn(*args, **kwargs))
+        except Exception as e:
+            reply = (False, e)
+        try:
+            data = pickle.dumps(reply)
+        except Exception as e:
+            data = pickle.dumps((False, RuntimeError(f"{type(e).__name__}: {e}")))
+        results.write(data)
+        results.flush()
+
+
+if __name__ == "__main__":
+    try:
+        _worker_main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,122 @@
+"""
+Кэш результатов поиска (hybrid_search, rag_semantic_search, grep_search)
+Популярные вопросы повторяются у разных пользователей - повторный запрос
+отдаётся из памяти без векторного поиска, MMR и keyword boosting
+
+Вытеснение: TTL + LRU. Инвалидация: к каждой записи привязана версия индекса -
+состояние файлов базы (chroma.sqlite3, keyword_index.npz) и текстового файла.
+После sync_vectorstore / правки cosmic_texts.txt версия другая, и старые
+записи не отдаются.
+"""
+
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+DEFAULT_MAX_SIZE = 256
+DEFAULT_TTL = 600.0  # секунд
+
+# Файлы базы, которые меняются при любой записи в коллекцию или пересборке индексов
+DB_VERSION_FILES = ("chroma.sqlite3", "chroma.sqlite3-wal", "keyword_index.npz")
+
+
+def file_version(path: str) -> Optional[Tuple[int, int]]:
+    """(размер, mtime_ns) файла (None - файла нет)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def index_version(db_path: Optional[str], text_file: Optional[str]) -> tuple:
+    """Версия индекса: состояние файлов базы db_path и текстового файла"""
+    db_files = tuple(file_version(os.path.join(db_path, name)) for name in DB_VERSION_FILES) if db_path else ()
+    return db_files, file_version(text_file) if text_file else None
+
+
+class ResultCache:
+    """
+    TTL + LRU кэш: ключ → (версия индекса, срок годности, результат)
+
+    Запись с другой версией индекса или истёкшим TTL считается промахом и удаляется.
+    Результат отдаётся копией: вызывающий код может менять списки/словари.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, ttl: float = DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[tuple, float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0  # промахов из-за смены версии индекса или TTL
+
+    def get(self, key: Hashable, version: tuple) -> Tuple[bool, Any]:
+        """(найдено, результат)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] != version or entry[1] < now):
+                del self._entries[key]
+                self.stale += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = entry[2]
+        return True, copy.deepcopy(value)
+
+    def put(self, key: Hashable, version: tuple, value: Any):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+_result_cache: Optional[ResultCache] = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache(max_size: Optional[int] = None, ttl: Optional[float] = None) -> ResultCache:
+    """Общий для процесса кэш результатов (параметры меняют лимиты существующего)"""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(
+                DEFAULT_MAX_SIZE if max_size is None else max_size,
+                DEFAULT_TTL if ttl is None else ttl
+            )
+        else:
+            if max_size is not None:
+                _result_cache.max_size = max_size
+            if ttl is not None:
+                _result_cache.ttl = ttl
+        return _result_cache
@@ -0,0 +1,134 @@
+"""
+Слияние результатов поиска для гибридного RAG
+Векторные (косинусная близость) и keyword (BM25) результаты объединяются по рангам
+(Reciprocal Rank Fusion) или по нормированным скорам (взвешенная сумма)
+Векторизованный MMR (Maximal Marginal Relevance) по матрице кандидатов
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Ранжированный список: [(chunk_id, score)] по убыванию score
+Ranking = List[Tuple[str, float]]
+
+# Сглаживание RRF: вклад документа на ранге r = 1 / (RRF_K + r)
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Ranking], weights: Optional[Sequence[float]] = None,
+                           rrf_k: int = RRF_K) -> Ranking:
+    """
+    Reciprocal Rank Fusion: score = sum(weight / (rrf_k + rank))
+
+    Учитывает только порядок внутри каждого списка, поэтому шкалы скоров
+    (косинус и BM25) не нужно согласовывать.
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, (chunk_id, _) in enumerate(ranking, 1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + weight / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def min_max_normalize(ranking: Ranking) -> Dict[str, float]:
+    """Скоры списка в диапазон [0, 1] (один документ или равные скоры → 1.0)"""
+    if not ranking:
+        return {}
+    scores = [score for _, score in ranking]
+    low, high = min(scores), max(scores)
+    if high - low < 1e-12:
+        return {chunk_id: 1.0 for chunk_id, _ in ranking}
+    return {chunk_id: (score - low) / (high - low) for chunk_id, score in ranking}
+
+
+def weighted_fusion(rankings: Sequence[Ranking], weights: Optional[Sequence[float]] = None) -> Ranking:
+    """
+    Взвешенная сумма нормированных скоров: score = sum(weight * norm_score)
+
+    Скоры каждого списка приводятся к [0, 1] (min-max), документ, которого
+    нет в списке, получает от него 0.
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for chunk_id, score in min_max_normalize(ranking).items():
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + weight * score
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+FUSION_METHODS = {
+    "rrf": reciprocal_rank_fusion,
+    "weighted": weighted_fusion,
+}
+
+
+def fuse_rankings(rankings: Sequence[Ranking], method: str = "rrf",
+                  weights: Optional[Sequence[float]] = None) -> Ranking:
+    """Слияние ранжированных списков выбранным методом ("rrf" или "weighted")"""
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method: {method} (expected one of {list(FUSION_METHODS)})")
+    return FUSION_METHODS[method](rankings, weights)
+
+
+def distance_to_similarity(distance: float, space: str = "l2") -> float:
+    """
+    Расстояние ChromaDB → косинусная близость (для нормированных векторов)
+
+    l2 в ChromaDB - квадрат евклидова расстояния: |a - b|^2 = 2 - 2cos
+    """
+    if space in ("cosine", "ip"):
+        return 1.0 - distance
+    return 1.0 - distance / 2.0
+
+
+def _unit_rows(matrix: np.ndarray) -> np.ndarray:
+    """Строки единичной длины (нулевые строки остаются нулевыми)"""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def mmr_select(query_embedding, candidate_embeddings, k: int = 4, lambda_mult: float = 0.5) -> List[int]:
+    """
+    Maximal Marginal Relevance по матрице кандидатов
+
+    score(i) = lambda * cos(q, c_i) - (1 - lambda) * max_{s in S} cos(c_i, c_s)
+
+    Максимальная близость к уже выбранным обновляется инкрементально: на каждом шаге
+    один матрично-векторный продукт O(n·d) вместо пересчёта близости ко всем
+    выбранным и Python-цикла по кандидатам (как в LangChain maximal_marginal_relevance).
+    Выбор совпадает с LangChain: первый - самый близкий к запросу, ничьи - меньший индекс.
+
+    Args:
+        query_embedding: вектор запроса
+        candidate_embeddings: векторы кандидатов [n x d] (как вернула векторная база)
+        k: сколько выбрать
+        lambda_mult: 1 - только релевантность, 0 - только разнообразие
+
+    Returns:
+        индексы выбранных кандидатов в порядке выбора
+    """
+    candidates = _unit_rows(np.asarray(candidate_embeddings, dtype=np.float32))
+    k = min(k, len(candidates))
+    if k <= 0:
+        return []
+
+    query = _unit_rows(np.asarray(query_embedding, dtype=np.float32).ravel())
+    relevance = candidates @ query
+
+    first = int(np.argmax(relevance))
+    selected = [first]
+    available = np.ones(len(candidates), dtype=bool)
+    available[first] = False
+    max_similarity = candidates @ candidates[first]
+
+    weighted_relevance = lambda_mult * relevance
+    while len(selected) < k:
+        scores = weighted_relevance - (1.0 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, candidates @ candidates[best], out=max_similarity)
+    return selected
@@ -5,6 +5,9 @@ SMART RAG Agent 2025 - Qwen3 Function Calling
 
 import gradio as gr
 from rag_advanced_memory import AdvancedRAGMemory
+from rag_ingestion import format_location
+from rag_keyword_matcher import KeywordMatcher
+from rag_text_store import get_text_store
 import os
 import json
 import re
@@ -123,6 +126,15 @@ class SmartQwenAgent:
         self.ULTIMATE_DB_PATH = self.project_dir / "chroma_db_ultimate"
         self.DEFAULT_TEXT_FILE = str(self.project_dir / "cosmic_texts.txt")
         self.EMBEDDING_MODEL = "intfloat/multilingual-e5-large"  # Ultimate модель
+        # "torch" - fp32 на GPU; на CPU-серверах "onnx-int8"/"int8"/"onnx" (та же база, быстрее запросы)
+        self.EMBEDDING_BACKEND = "torch"
+        # Потоки torch (None - авто) и число запросов, одновременно векторизуемых моделью
+        self.TORCH_THREADS = None
+        self.MAX_CONCURRENT_EMBEDDINGS = 1
+        # "chroma" - HNSW; "exact" - точный перебор по float16 матрице (детерминированный recall)
+        self.VECTOR_ENGINE = "chroma"
+        # ef_search HNSW для семантического поиска (None - настройка базы; см. hnsw_sweep.py)
+        self.SEMANTIC_EF_SEARCH = None
 
         self.rag = None
         self.is_initialized = False
@@ -214,16 +226,19 @@ class SmartQwenAgent:
                 max_context_tokens=20000,  # Увеличено до 20000 токенов
                 summarize_threshold=14000,  # 70% от 20000
                 enable_auto_summarize=True,
-                use_gpu=True
+                use_gpu=True,
+                embedding_backend=self.EMBEDDING_BACKEND,
+                torch_threads=self.TORCH_THREADS,
+                max_concurrent_embeddings=self.MAX_CONCURRENT_EMBEDDINGS,
+                vector_engine=self.VECTOR_ENGINE
             )
 
             progress(0.4, desc="🧠 Загрузка embedding модели (2.2GB)...")
 
-            from langchain_community.vectorstores import Chroma
-            self.rag.vectorstore = Chroma(
-                persist_directory=str(self.ULTIMATE_DB_PATH),
-                embedding_function=self.rag.embeddings
-            )
+            self.rag.load_vectorstore()
+            if self.EMBEDDING_BACKEND != "torch":
+                # Векторы запросов должны совпадать с fp32 векторами базы
+                self.rag.verify_embedding_parity()
 
             progress(0.7, desc="🔗 Подключение к Qwen3...")
             # Подключаемся к Qwen3 через LM Studio
@@ -272,31 +287,38 @@ class SmartQwenAgent:
             return f"❌ Ошибка выгрузки: {str(e)}"
 
     def grep_search(self, query: str, context_lines: int = 5):
+        """Инструмент: текстовый поиск (повтор к той же версии текста - из кэша результатов)"""
+        return self.rag.cached_result(
+            "grep_search", query, (context_lines,),
+            lambda: self._grep_search(query, context_lines)
+        )
+
+    def _grep_search(self, query: str, context_lines: int = 5):
         """Инструмент: точный текстовый поиск с fuzzy и поддержкой фраз"""
         logger.info(f"[TOOL] grep_search: '{query}'")
 
         try:
-            text_file = self.rag.text_file_path
-            with open(text_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-
-            # Сначала пробуем точный поиск по фразе (для "магический год")
-            exact_pattern = re.compile(re.escape(query), re.IGNORECASE)
-            exact_matches = []
-
-            for i, line in enumerate(lines):
-                if exact_pattern.search(line):
-                    start = max(0, i - context_lines)
-                    end = min(len(lines), i + context_lines + 1)
-                    context = ''.join(lines[start:end])
-                    exact_matches.append({
-                        'line_num': i + 1,
-                        'context': context[:500],
-                        'matched_line': line.strip()[:200],
-                        'match_type': 'exact'
-                    })
-                    if len(exact_matches) >= 15:
-                        break
+            # Текст отображён в память один раз на процесс, строки - по смещениям
+            store = get_text_store(self.rag.text_file_path)
+
+            # Ключевые слова для fuzzy поиска
+            stopwords = {'что', 'как', 'где', 'когда', 'зачем', 'почему', 'какой', 'какая', 'какие', 'для', 'работы', 'канал', 'частота', 'про', 'тебе', 'известно'}
+            words = re.findall(r'\b[а-яёА-ЯЁ]{3,}\b', query.lower())
+            keywords = [w for w in words if w not in stopwords]
+
+            # Точная фраза (для "магический год") и первые 3 ключевых слова (пробелы/дефисы
+            # внутри слова допускаются) - за ОДИН проход по тексту
+            exact_lines, fuzzy_lines = store.grep_exact_fuzzy(query, keywords[:3], max_lines=15)
+
+            def match(i, match_type):
+                return {
+                    'line_num': i + 1,
+                    'context': store.context(i, context_lines, context_lines)[:500],
+                    'matched_line': store.line(i).strip()[:200],
+                    'match_type': match_type
+                }
+
+            exact_matches = [match(i, 'exact') for i in exact_lines]
 
             # Если точное совпадение дало результаты - возвращаем их
             if len(exact_matches) >= 3:
@@ -309,38 +331,12 @@ class SmartQwenAgent:
                     "message": f"Найдено {len(exact_matches)} точных совпадений фразы '{query}'. Этого достаточно для ответа!"
                 }
 
-            # Иначе делаем fuzzy поиск по ключевым словам
-            stopwords = {'что', 'как', 'где', 'когда', 'зачем', 'почему', 'какой', 'какая', 'какие', 'для', 'работы', 'канал', 'частота', 'про', 'тебе', 'известно'}
-            words = re.findall(r'\b[а-яёА-ЯЁ]{3,}\b', query.lower())
-            keywords = [w for w in words if w not in stopwords]
-
             if not keywords:
                 # Если ключевых слов нет - используем точный поиск
                 results = exact_matches
             else:
-                fuzzy_words = []
-                for keyword in keywords[:3]:  # Берём первые 3 ключевых слова
-                    chars = list(keyword)
-                    fuzzy_word = ''.join([re.escape(c) + r'[\s\-]*' for c in chars[:-1]]) + re.escape(chars[-1])
-                    fuzzy_words.append(fuzzy_word)
-                fuzzy_pattern = '|'.join([f'\\b{fw}\\b' for fw in fuzzy_words])
-                pattern = re.compile(fuzzy_pattern, re.IGNORECASE)
-
-                results = []
-                for i, line in enumerate(lines):
-                    if pattern.search(line):
-                        start = max(0, i - context_lines)
-                        end = min(len(lines), i + context_lines + 1)
-                        context = ''.join(lines[start:end])
-                        results.append({
-                            'line_num': i + 1,
-                            'context': context[:500],
-                            'matched_line': line.strip()[:200],
-                            'match_type': 'fuzzy'
-                        })
-
-                        if len(results) >= 15:
-                            break
+                # Строки с ключевыми словами; где есть и точная фраза - помечены как exact
+                results = [match(i, 'exact' if has_exact else 'fuzzy') for i, has_exact in fuzzy_lines]
 
             logger.info(f"[TOOL] grep_search: найдено {len(results)} совпадений (fuzzy)")
 
@@ -357,7 +353,14 @@ class SmartQwenAgent:
             return {"error": str(e)}
 
     def rag_semantic_search(self, query: str, num_sources: int = 20):
-        """Инструмент: семантический поиск"""
+        """Инструмент: семантический поиск (повтор к той же версии базы - из кэша результатов)"""
+        return self.rag.cached_result(
+            "rag_semantic_search", query, (num_sources, self.SEMANTIC_EF_SEARCH),
+            lambda: self._rag_semantic_search(query, num_sources)
+        )
+
+    def _rag_semantic_search(self, query: str, num_sources: int = 20):
+        """Семантический поиск через MMR ретривер"""
         logger.info(f"[TOOL] rag_semantic_search: '{query}', sources={num_sources}")
 
         try:
@@ -365,7 +368,8 @@ class SmartQwenAgent:
             search_kwargs = {
                 "k": num_sources,
                 "fetch_k": num_sources * 3,
-                "lambda_mult": 0.5
+                "lambda_mult": 0.5,
+                "ef_search": self.SEMANTIC_EF_SEARCH
             }
             self.rag.retriever.search_kwargs = search_kwargs
 
@@ -406,13 +410,18 @@ class SmartQwenAgent:
         religious_keywords = ['православ', 'церков', 'богослуж', 'канон', 'литурги', 'молебен', 'собор', 'храм']
         esoteric_keywords = ['космоэнергет', 'канал', 'частот', 'энерги', 'эзотерик', 'магическ', 'обряд', 'ритуал']
 
+        # Все ключевые слова - один автомат: запрос и документы проверяются за один проход
+        matcher = KeywordMatcher(religious_keywords + esoteric_keywords)
+        religious = slice(0, len(religious_keywords))
+        esoteric = slice(len(religious_keywords), None)
+
         # Проверяем запрос
-        is_religious_query = any(kw in query_lower for kw in religious_keywords)
+        is_religious_query = any(matcher.found(query_lower)[religious])
 
         # Проверяем документы
-        doc_text = ' '.join(documents).lower()
-        has_esoteric_content = any(kw in doc_text for kw in esoteric_keywords)
-        has_religious_content = any(kw in doc_text for kw in religious_keywords)
+        doc_found = matcher.found(' '.join(documents).lower())
+        has_esoteric_content = any(doc_found[esoteric])
+        has_religious_content = any(doc_found[religious])
 
         # Формируем предупреждение
         if is_religious_query and has_esoteric_content and not has_religious_content:
@@ -426,9 +435,6 @@ class SmartQwenAgent:
         """Инструмент: генерация синонимов"""
         logger.info(f"[TOOL] expand_query: '{term}'")
 
-        # Простая логика расширения для русских терминов
-        term_lower = term.lower()
-
         # Типичные варианты написания
         variants = [term]
 
@@ -437,10 +443,10 @@ class SmartQwenAgent:
             variants.append(term.replace('-', ''))
             variants.append(term.replace('-', ' '))
 
-        # Варианты окончаний (Мектабу → Мектаба, Мектаб)
-        if term_lower.endswith('у'):
-            variants.append(term[:-1] + 'а')
-            variants.append(term[:-1])
+        # Формы слова, которые реально есть в корпусе (Мектабу → Мектаба, Мектаб):
+        # индекс лемм базы, одно обращение к словарю вместо правил окончаний
+        forms = self.rag.load_keyword_index().surface_forms(term)
+        variants.extend(form.capitalize() if term[:1].isupper() else form for form in forms)
 
         logger.info(f"[TOOL] expand_query: варианты {variants}")
 
@@ -713,9 +719,10 @@ class SmartQwenAgent:
             sources_html = "<div style='margin-top: 20px;'><hr style='border: 1px solid rgba(255,255,255,0.2);'><h4>📚 Использованные источники:</h4>"
             for i, doc in enumerate(documents[:5], 1):
                 content = html.escape(doc.get('content', '')[:200])
+                location = format_location(doc.get('metadata'))
                 sources_html += f"""
                 <div class='source-doc'>
-                    <b>Источник {i}:</b><br>
+                    <b>Источник {i}:</b>{f' <small>({location})</small>' if location else ''}<br>
                     <small>{content}...</small>
                 </div>
                 """
@@ -776,6 +783,12 @@ class SmartQwenAgent:
             return "❌ Система не инициализирована!"
 
         stats = self.rag.get_memory_stats()
+        cache = stats['query_cache']
+        cache_line = (f"{cache['hits']} попаданий / {cache['misses']} промахов ({cache['entries']} запросов)"
+                      if cache else "выключен")
+        results = stats['result_cache']
+        results_line = (f"{results['hits']} попаданий / {results['misses']} промахов ({results['entries']} записей)"
+                        if results else "выключен")
         return f"""📊 Статистика SMART Agent
 
 🕐 Длительность сессии: {stats['session_duration']}
@@ -785,7 +798,9 @@ class SmartQwenAgent:
 
 💾 База: Ultimate (multilingual-e5-large)
 🧠 Модель: Qwen3-30B-A3B
-⚙️ Автосуммаризация: {'✅' if stats['auto_summarize_enabled'] else '❌'}"""
+⚙️ Автосуммаризация: {'✅' if stats['auto_summarize_enabled'] else '❌'}
+🔁 Кэш векторов запросов: {cache_line}
+🗂️ Кэш результатов поиска: {results_line}"""
 
     def clear_memory(self, keep_summaries: bool):
         """Очистка памяти"""
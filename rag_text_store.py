@@ -0,0 +1,634 @@
+"""
+Общее хранилище исходного текста для grep_search
+Файл (cosmic_texts.txt) отображается в память один раз на процесс, границы строк
+хранятся массивом смещений, поиск идёт по байтам без readlines() и без списка строк
+
+Рядом с текстом (<файл>.index/) сохраняются:
+- lines.npz  - смещения начала строк + размер и mtime файла (проверка актуальности)
+- folded.bin - текст в нижнем регистре той же длины в байтах: регистронезависимый
+               поиск = обычный поиск байтов, смещения совпадают с исходным файлом
+- shadow.bin - теневая копия для fuzzy поиска: folded текст без пробелов (и Unicode) и дефисов,
+               ё → е, переводы строк сохранены; shadow_lines.npy - начала её строк
+               (строка i теневой копии = строка i исходного текста)
+Файлы открываются через mmap - страницы общие для всех процессов.
+"""
+
+import functools
+import mmap
+import os
+import re
+import threading
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Pattern, Sequence, Tuple
+
+import numpy as np
+
+from rag_keyword_matcher import KeywordMatcher
+from rag_process_pool import LightProcessPool
+
+INDEX_SUFFIX = ".index"
+INDEX_FORMAT = 1
+FOLDED_FORMAT = 2  # 2 - невалидный UTF-8 не отменяет нижний регистр остального текста
+SHADOW_FORMAT = 3  # 2 - удаляются и Unicode пробелы; 3 - строится из folded формата 2
+
+# Разделители, допустимые внутри слова при fuzzy поиске ("Фи-раст", "Фи раст", "Фи\u00a0раст"):
+# дефис и все пробельные символы, как \s у str regex (str.isspace()), кроме перевода строки
+GAP_CHARS = ('-\t\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005'
+             '\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000')
+GAP_BYTES = bytes(ord(char) for char in GAP_CHARS if ord(char) < 0x80)
+GAP_SEQUENCES = [char.encode('utf-8') for char in GAP_CHARS if ord(char) >= 0x80]  # многобайтные в UTF-8
+FUZZY_GAP = (b'(?:[' + re.escape(GAP_BYTES) + b']|'
+             + b'|'.join(re.escape(sequence) for sequence in GAP_SEQUENCES) + b')*')
+
+# е и ё при fuzzy поиске не различаются (в теневой копии ё → е)
+YO_PATTERN = rb'(?:\xd0\xb5|\xd1\x91)'
+
+# Блок построения folded/теневой копии (выравнивается по концу строки): память
+# при сборке индексов - несколько копий блока, а не всего файла
+INDEX_BLOCK = 16 * 1024 * 1024
+
+# Regex grep: диапазон строк (~байт) на одну задачу и минимальный размер файла,
+# с которого поиск идёт в пуле процессов. Первые диапазоны меньше (64 KB, 128 KB, ...):
+# при раннем выходе по max_lines не декодируются лишние мегабайты
+GREP_FIRST_RANGE_BYTES = 64 * 1024
+GREP_RANGE_BYTES = 8 * 1024 * 1024
+GREP_PARALLEL_MIN_BYTES = 32 * 1024 * 1024
+DEFAULT_GREP_WORKERS = min(8, os.cpu_count() or 1)
+
+# Буквы/цифры в folded UTF-8 (для границ слова, как \b): ASCII и 2-байтные
+# последовательности кириллицы (D0-D3) и Latin-1 (C3)
+WORD_BYTE = rb'[0-9a-z_]'
+WORD_PAIR = rb'[\xc3\xd0-\xd3][\x80-\xbf]'
+
+
+def fold(text: str) -> str:
+    """Нижний регистр без изменения длины в байтах UTF-8 (редкие символы остаются как есть)"""
+    folded = text.lower()
+    if len(folded.encode('utf-8')) == len(text.encode('utf-8')):
+        return folded
+    return ''.join(
+        low if len(low) == 1 and len(low.encode('utf-8')) == len(char.encode('utf-8')) else char
+        for char, low in ((char, char.lower()) for char in text)
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _length_changing_case() -> Pattern[str]:
+    """Символы, у которых lower() меняет длину в UTF-8 или число символов (İ, K Кельвина, ...)"""
+    chars = ''.join(
+        char for char in map(chr, range(0x110000))
+        if not 0xD800 <= ord(char) <= 0xDFFF and char.lower() != char
+        and (len(char.lower()) != 1 or len(char.lower().encode('utf-8')) != len(char.encode('utf-8')))
+    )
+    return re.compile('([' + re.escape(chars) + '])')
+
+
+def fold_bytes(data: bytes) -> bytes:
+    """
+    fold() для байтов UTF-8 (блок файла): та же длина и те же смещения
+
+    Невалидные байты остаются как есть (surrogateescape) и не влияют на остальной текст;
+    символы, меняющие длину в нижнем регистре, не меняются - без цикла по символам.
+    """
+    parts = _length_changing_case().split(data.decode('utf-8', errors='surrogateescape'))
+    parts[::2] = [part.lower() for part in parts[::2]]
+    return ''.join(parts).encode('utf-8', errors='surrogateescape')
+
+
+def _join_chars(chars: List[bytes], gap: bytes, whole_word: bool) -> bytes:
+    """
+    Символы через gap; whole_word - границы слова с обеих сторон
+
+    Граница перед словом проверяется lookbehind ПОСЛЕ первого символа: шаблон начинается
+    с литерала, и regex ищет его быстрым сканированием, а не проверяет каждую позицию.
+    """
+    if not whole_word or not chars:
+        return gap.join(chars)
+    first = chars[0]
+    return (first + rb'(?<!' + WORD_BYTE + first + rb')(?<!' + WORD_PAIR + first + rb')'
+            + (gap if len(chars) > 1 else b'') + gap.join(chars[1:])
+            + rb'(?!' + WORD_BYTE + rb'|' + WORD_PAIR + rb')')
+
+
+def literal_pattern(text: str, whole_word: bool = False) -> bytes:
+    """Регистронезависимый литерал для поиска по folded тексту"""
+    return _join_chars([re.escape(char.encode('utf-8')) for char in fold(text)], b'', whole_word)
+
+
+def fuzzy_pattern(word: str, whole_word: bool = True) -> bytes:
+    """Слово, допускающее пробелы/дефисы между буквами и ё/е (как \\bс[\\s\\-]*л[\\s\\-]*о\\b)"""
+    chars = [YO_PATTERN if char in 'её' else re.escape(char.encode('utf-8')) for char in fold(word)]
+    return _join_chars(chars, FUZZY_GAP, whole_word)
+
+
+def shadow_text(text: str) -> bytes:
+    """Текст в виде теневой копии: folded, без GAP_CHARS (пробелов, дефисов, ...), ё → е"""
+    return fold(text).replace('ё', 'е').translate(_GAP_TABLE).encode('utf-8')
+
+
+_GAP_TABLE = str.maketrans('', '', GAP_CHARS)
+
+
+def compile_patterns(patterns: Sequence[bytes]) -> Pattern[bytes]:
+    """Объединение байтовых шаблонов через | в один regex"""
+    return re.compile(b'|'.join(b'(?:' + pattern + b')' for pattern in patterns))
+
+
+class TextStore:
+    """
+    Исходный текст в памяти (mmap) + границы строк
+
+    Строка i - байты [bounds[i], bounds[i + 1]) включая '\\n', как у readlines().
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.realpath(path)
+        self.index_path = self.path + INDEX_SUFFIX
+        stat = os.stat(self.path)
+        self.version = (stat.st_size, stat.st_mtime_ns)
+        self.size = stat.st_size
+
+        self._file = open(self.path, 'rb')
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self._folded = None
+        self._folded_file = None
+        self._shadow = None
+        self._shadow_file = None
+        self.shadow_bounds: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+        self.bounds = self._load_bounds()
+        if self.bounds is None:
+            self.bounds = self._build_bounds()
+            self._save_bounds()
+
+    # --- индекс строк ---
+
+    def _load_bounds(self) -> Optional[np.ndarray]:
+        try:
+            with np.load(os.path.join(self.index_path, "lines.npz")) as saved:
+                if int(saved['format']) != INDEX_FORMAT or tuple(saved['version']) != self.version:
+                    return None
+                return saved['bounds']
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _build_bounds(self) -> np.ndarray:
+        buffer = np.frombuffer(self.data, dtype=np.uint8) if self.size else np.empty(0, dtype=np.uint8)
+        starts = np.concatenate([[0], np.flatnonzero(buffer == 0x0A) + 1]).astype(np.int64)
+        if starts[-1] == self.size:
+            starts = starts[:-1]  # файл заканчивается '\n' - пустой последней строки нет
+        return np.append(starts, self.size)
+
+    def _save_bounds(self):
+        try:
+            os.makedirs(self.index_path, exist_ok=True)
+            tmp_path = os.path.join(self.index_path, "lines.tmp.npz")
+            np.savez(tmp_path, bounds=self.bounds, version=np.array(self.version, dtype=np.int64),
+                     format=INDEX_FORMAT)
+            os.replace(tmp_path, os.path.join(self.index_path, "lines.npz"))
+        except OSError as e:
+            print(f"⚠️ Line index not saved ({self.index_path}): {e}")
+
+    # --- регистронезависимая копия ---
+
+    @property
+    def folded(self):
+        """Текст в нижнем регистре (та же длина и те же смещения, что у data)"""
+        if self._folded is None:
+            with self._lock:
+                if self._folded is None:
+                    self._folded = self._load_folded()
+        return self._folded
+
+    def _load_folded(self):
+        folded_path = os.path.join(self.index_path, "folded.bin")
+        version_path = os.path.join(self.index_path, "folded.version")
+        try:
+            with open(version_path, encoding='utf-8') as f:
+                current = f.read().strip() == f"{FOLDED_FORMAT}:{self.version[0]}:{self.version[1]}"
+            if current and os.path.getsize(folded_path) == self.size:
+                if not self.size:
+                    return b''
+                self._folded_file = open(folded_path, 'rb')
+                return mmap.mmap(self._folded_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            pass
+
+        try:
+            os.makedirs(self.index_path, exist_ok=True)
+            with open(folded_path + ".tmp", 'wb') as f:
+                for start, end in self._blocks(self.data):
+                    f.write(fold_bytes(self.data[start:end]))
+            os.replace(folded_path + ".tmp", folded_path)
+            with open(version_path, 'w', encoding='utf-8') as f:
+                f.write(f"{FOLDED_FORMAT}:{self.version[0]}:{self.version[1]}")
+            if not self.size:
+                return b''
+            self._folded_file = open(folded_path, 'rb')
+            return mmap.mmap(self._folded_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError as e:
+            print(f"⚠️ Folded text not saved ({self.index_path}): {e}")
+        return b''.join(fold_bytes(self.data[start:end]) for start, end in self._blocks(self.data))
+
+    def _blocks(self, data) -> Iterator[Tuple[int, int]]:
+        """Диапазоны [start, end) примерно по INDEX_BLOCK байт, граница - конец строки"""
+        start = 0
+        while start < self.size:
+            end = data.find(b'\n', min(start + INDEX_BLOCK, self.size) - 1)
+            end = self.size if end < 0 else end + 1
+            yield start, end
+            start = end
+
+    # --- теневая копия для fuzzy поиска ---
+
+    @property
+    def shadow(self):
+        """Теневая копия (shadow_text всего файла), её строки - shadow_bounds"""
+        if self._shadow is None:
+            folded = self.folded
+            with self._lock:
+                if self._shadow is None:
+                    self._shadow = self._load_shadow(folded)
+        return self._shadow
+
+    def _load_shadow(self, folded):
+        shadow_path = os.path.join(self.index_path, "shadow.bin")
+        bounds_path = os.path.join(self.index_path, "shadow_lines.npy")
+        version_path = os.path.join(self.index_path, "shadow.version")
+        try:
+            with open(version_path, encoding='utf-8') as f:
+                current = f.read().strip() == f"{SHADOW_FORMAT}:{self.version[0]}:{self.version[1]}"
+            if current:
+                bounds = np.load(bounds_path)
+                if len(bounds) == len(self.bounds) and bounds[-1] == os.path.getsize(shadow_path):
+                    self.shadow_bounds = bounds
+                    if not bounds[-1]:
+                        return b''
+                    self._shadow_file = open(shadow_path, 'rb')
+                    return mmap.mmap(self._shadow_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            pass
+
+        try:
+            os.makedirs(self.index_path, exist_ok=True)
+            with open(shadow_path + ".tmp", 'wb') as f:
+                self.shadow_bounds = self._build_shadow(folded, f.write)
+            os.replace(shadow_path + ".tmp", shadow_path)
+            with open(bounds_path + ".tmp", 'wb') as f:
+                np.save(f, self.shadow_bounds)
+            os.replace(bounds_path + ".tmp", bounds_path)
+            with open(version_path, 'w', encoding='utf-8') as f:
+                f.write(f"{SHADOW_FORMAT}:{self.version[0]}:{self.version[1]}")
+            if not self.shadow_bounds[-1]:
+                return b''
+            self._shadow_file = open(shadow_path, 'rb')
+            return mmap.mmap(self._shadow_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError as e:
+            print(f"⚠️ Shadow text not saved ({self.index_path}): {e}")
+        parts = []
+        self.shadow_bounds = self._build_shadow(folded, parts.append)
+        return b''.join(parts)
+
+    def _build_shadow(self, folded, write) -> np.ndarray:
+        """
+        Теневая копия блоками по INDEX_BLOCK байт (граница блока - конец строки,
+        многобайтные символы не разрываются); переводы строк остаются, поэтому строк столько же
+
+        Блоки отдаются в write, возвращаются начала строк теневой копии.
+        """
+        # Класс байта одной таблицей: 1 - удаляемый байт, 2 - первый байт многобайтного пробела
+        byte_class = np.zeros(256, dtype=np.uint8)
+        byte_class[list(GAP_BYTES)] = 1
+        byte_class[[sequence[0] for sequence in GAP_SEQUENCES]] = 2
+        newlines = []
+        written = 0
+        for start, end in self._blocks(folded):
+            block = np.frombuffer(folded[start:end], dtype=np.uint8).copy()
+            yo = np.flatnonzero((block[:-1] == 0xD1) & (block[1:] == 0x91))
+            block[yo], block[yo + 1] = 0xD0, 0xB5
+            classes = byte_class[block]
+            remove = classes == 1
+            # Многобайтные пробелы: проверяются только позиции с их первым байтом
+            leads = np.flatnonzero(classes == 2)
+            for sequence in GAP_SEQUENCES:
+                at = leads[leads <= len(block) - len(sequence)]
+                for offset, byte in enumerate(sequence):
+                    at = at[block[at + offset] == byte]
+                for offset in range(len(sequence)):
+                    remove[at + offset] = True
+            block = block[~remove]
+            newlines.append(np.flatnonzero(block == 0x0A) + written + 1)
+            write(block.tobytes())
+            written += len(block)
+
+        starts = np.concatenate([[0]] + newlines).astype(np.int64)
+        if starts[-1] == written:
+            starts = starts[:-1]  # как _build_bounds: без пустой последней строки
+        return np.append(starts, written)
+
+    def build_indexes(self):
+        """Построить (или проверить) все индексы заранее - при сборке базы, а не на первом запросе"""
+        self.shadow
+
+    # --- строки ---
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    def is_current(self) -> bool:
+        """Файл не менялся с момента открытия (размер и mtime)"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == self.version
+
+    def line_at(self, offset: int) -> int:
+        """Номер строки (с 0), содержащей байт offset"""
+        return int(np.searchsorted(self.bounds, offset, side='right')) - 1
+
+    def lines(self, start: int, end: int) -> str:
+        """Строки [start, end) одним куском (с '\\n', как ''.join(readlines()[start:end]))"""
+        start, end = max(0, start), min(len(self), end)
+        if start >= end:
+            return ''
+        text = self.data[int(self.bounds[start]):int(self.bounds[end])].decode('utf-8', errors='replace')
+        return text.replace('\r\n', '\n')  # как текстовый режим open()
+
+    def line(self, index: int) -> str:
+        return self.lines(index, index + 1)
+
+    def context(self, index: int, before: int, after: int) -> str:
+        """Строка index с before строками до и after после"""
+        return self.lines(index - before, index + after + 1)
+
+    def iter_lines(self, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """(номер, строка) без чтения файла целиком"""
+        for index in range(start, len(self) if end is None else min(end, len(self))):
+            yield index, self.line(index)
+
+    # --- поиск ---
+
+    def grep(self, pattern: Pattern[bytes], max_lines: Optional[int] = None,
+             start: int = 0, end: Optional[int] = None) -> List[int]:
+        """
+        Номера строк (с 0, по возрастанию) с совпадением байтового pattern в folded тексте
+
+        Args:
+            pattern: скомпилированный regex по folded байтам (literal_pattern/fuzzy_pattern)
+            max_lines: остановиться после стольких строк
+            start, end: диапазон байтов для поиска
+        """
+        offsets = []
+        folded = self.folded
+        end = self.size if end is None else end
+        position = start
+        while position < end:
+            match = pattern.search(folded, position, end)
+            if match is None:
+                break
+            offsets.append(match.start())
+            if max_lines is not None and len(offsets) >= max_lines:
+                break
+            # Остальные совпадения в этой строке не нужны - со следующей строки
+            line_end = folded.find(b'\n', match.start(), end)
+            position = end if line_end < 0 else line_end + 1
+        return self._lines_of(offsets)
+
+    def _shadow_lines(self, needles: Sequence[bytes], start_line: int = 0) -> Iterator[Tuple[int, int, int]]:
+        """
+        Строки (по возрастанию), где в теневой копии есть хотя бы одна из needles:
+        (номер строки, начало и конец строки в исходном/folded тексте)
+
+        Все needles ищутся одним KeywordMatcher (подстроки, без regex); после строки
+        с совпадением поиск продолжается со следующей строки. Номера и границы строк
+        считаются пачками (одним searchsorted): 16, 32, ... до 1024 совпадений - при раннем
+        выходе лишних поисков немного.
+        """
+        if start_line >= len(self):
+            return
+        shadow = self.shadow
+        size = int(self.shadow_bounds[-1])
+        scanner = KeywordMatcher(needles).scanner(shadow)
+        position = int(self.shadow_bounds[start_line])
+        batch_size = 16
+        while True:
+            offsets = []
+            while len(offsets) < batch_size:
+                offset, _ = scanner.find(position)
+                if offset < 0:
+                    break
+                offsets.append(offset)
+                line_end = shadow.find(b'\n', offset)
+                position = size if line_end < 0 else line_end + 1
+            if not offsets:
+                return
+            lines = np.searchsorted(self.shadow_bounds, offsets, side='right') - 1
+            yield from zip(lines.tolist(), self.bounds[lines].tolist(), self.bounds[lines + 1].tolist())
+            batch_size = min(batch_size * 2, 1024)
+
+    def grep_fuzzy(self, keywords: Sequence[str], max_lines: Optional[int] = None) -> List[int]:
+        """
+        Номера строк, где есть любое из keywords целым словом (fuzzy_pattern)
+
+        Кандидаты - поиск подстрок shadow_text(keyword) в теневой копии; в строке кандидата
+        fuzzy_pattern проверяет границы слова по folded тексту. Regex с необязательным
+        разделителем между каждой парой букв по всему тексту больше не выполняется.
+        """
+        search = compile_patterns([fuzzy_pattern(keyword) for keyword in keywords]).search
+        folded = self.folded
+        found = []
+        for line, start, end in self._shadow_lines([shadow_text(keyword) for keyword in keywords]):
+            if search(folded, start, end) is not None:
+                found.append(line)
+                if max_lines is not None and len(found) >= max_lines:
+                    break
+        return found
+
+    def grep_exact_fuzzy(self, phrase: str, keywords: Sequence[str] = (),
+                         max_lines: int = 15) -> Tuple[List[int], List[Tuple[int, bool]]]:
+        """
+        Точная фраза и fuzzy ключевые слова за один проход по теневой копии
+
+        Ключевые слова взяты из самой фразы: любое вхождение фразы содержит их подстроки
+        и тоже попадает в кандидаты (если ни одно слово не входит во фразу, ищется и она сама).
+        Строка кандидата классифицируется в своих границах: точная фраза / слово целиком.
+        Когда fuzzy строк набралось max_lines, проход продолжается только по точной фразе
+        до max_lines точных строк или конца текста.
+
+        Args:
+            phrase: точная фраза (регистр не важен)
+            keywords: ключевые слова для fuzzy_pattern (пусто - только фраза)
+            max_lines: лимит строк каждого вида
+
+        Returns:
+            (строки с точной фразой, [(строка с ключевым словом, есть ли в ней точная фраза)])
+        """
+        exact_re = re.compile(literal_pattern(phrase))
+        phrase_needle = shadow_text(phrase)
+        fuzzy_re = compile_patterns([fuzzy_pattern(keyword) for keyword in keywords]) if keywords else None
+        needles = [shadow_text(keyword) for keyword in keywords]
+        if not any(needle in phrase_needle for needle in needles):
+            needles.append(phrase_needle)
+
+        folded = self.folded
+        exact_lines: List[int] = []
+        fuzzy_lines: List[Tuple[int, bool]] = []
+        next_line = 0
+        if fuzzy_re is not None:
+            for line, start, end in self._shadow_lines(needles):
+                next_line = line + 1
+                has_exact = exact_re.search(folded, start, end) is not None
+                if has_exact:
+                    exact_lines.append(line)
+                if fuzzy_re.search(folded, start, end) is not None:
+                    fuzzy_lines.append((line, has_exact))
+                if len(exact_lines) >= max_lines or len(fuzzy_lines) >= max_lines:
+                    break
+            else:
+                return exact_lines, fuzzy_lines
+
+        # Дальше только точная фраза
+        if len(exact_lines) < max_lines:
+            for line, start, end in self._shadow_lines([phrase_needle], next_line):
+                if exact_re.search(folded, start, end) is not None:
+                    exact_lines.append(line)
+                    if len(exact_lines) >= max_lines:
+                        break
+        return exact_lines, fuzzy_lines
+
+    def _lines_of(self, offsets: List[int]) -> List[int]:
+        """Номера строк для списка смещений (одним searchsorted)"""
+        if not offsets:
+            return []
+        return (np.searchsorted(self.bounds, offsets, side='right') - 1).tolist()
+
+    def grep_regex(self, pattern: Pattern[str], max_lines: Optional[int] = None,
+                   workers: Optional[int] = None) -> List[int]:
+        """
+        Поиск произвольного str regex построчно (для пользовательских регулярных выражений)
+
+        Текст делится на диапазоны целых строк (до GREP_RANGE_BYTES); у больших файлов
+        диапазоны ищутся в пуле процессов (каждый открывает тот же mmap), результаты
+        сливаются в порядке строк. При max_lines новые диапазоны перестают отправляться,
+        как только у готового префикса диапазонов набралось max_lines строк.
+
+        Args:
+            pattern: скомпилированный str regex
+            max_lines: остановиться после стольких строк
+            workers: процессов (None - DEFAULT_GREP_WORKERS; 0/1 - в текущем процессе)
+        """
+        workers = DEFAULT_GREP_WORKERS if workers is None else workers
+        ranges = self._line_ranges(GREP_RANGE_BYTES)
+        if workers > 1 and self.size >= GREP_PARALLEL_MIN_BYTES and len(ranges) > 1:
+            tasks = self._grep_regex_parallel(pattern, ranges, max_lines, workers)
+        else:
+            tasks = (self._grep_regex_range(pattern, start, end, max_lines) for start, end in ranges)
+
+        found = []
+        for lines in tasks:
+            found.extend(lines)
+            if max_lines is not None and len(found) >= max_lines:
+                tasks.close()  # незапущенные диапазоны отменяются
+                return found[:max_lines]
+        return found
+
+    def _line_ranges(self, range_bytes: int) -> List[Tuple[int, int]]:
+        """Диапазоны строк [start, end): GREP_FIRST_RANGE_BYTES, вдвое больше, ... до range_bytes"""
+        if not len(self):
+            return []
+        positions = []
+        position, step = 0, min(GREP_FIRST_RANGE_BYTES, range_bytes)
+        while position < self.size:
+            positions.append(position)
+            position += step
+            step = min(step * 2, range_bytes)
+        cuts = np.searchsorted(self.bounds, positions, side='left')
+        cuts = np.unique(np.append(cuts, len(self))).tolist()
+        return list(zip(cuts[:-1], cuts[1:]))
+
+    def _grep_regex_parallel(self, pattern: Pattern[str], ranges: List[Tuple[int, int]],
+                             max_lines: Optional[int], workers: int) -> Iterator[List[int]]:
+        """Результаты диапазонов по порядку; в работе не более 2 x workers диапазонов"""
+        executor = get_grep_executor(workers)
+        pending = deque()
+        try:
+            for start, end in ranges:
+                pending.append(executor.submit(_grep_regex_worker, self.path, self.version,
+                                               pattern, start, end, max_lines))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _grep_regex_range(self, pattern: Pattern[str], start: int, end: int,
+                          max_lines: Optional[int] = None) -> List[int]:
+        """Номера строк [start, end) с совпадением (строки - как у line(): с '\\n', '\\r\\n' → '\\n')"""
+        text = self.data[int(self.bounds[start]):int(self.bounds[end])].decode('utf-8', errors='replace')
+        lines = text.replace('\r\n', '\n').split('\n')
+        last = len(lines) - 1  # после последнего '\n' - пустой хвост или строка без '\n'
+        found = []
+        search = pattern.search
+        for offset, line in enumerate(lines[:end - start]):
+            if search(line + '\n' if offset < last else line):
+                found.append(start + offset)
+                if max_lines is not None and len(found) >= max_lines:
+                    break
+        return found
+
+    def close(self):
+        for handle in (self.data, self._folded, self._folded_file, self._shadow, self._shadow_file, self._file):
+            close = getattr(handle, 'close', None)
+            if close is not None:
+                close()
+
+
+_stores: Dict[str, TextStore] = {}
+_stores_lock = threading.Lock()
+
+_grep_executor: Optional[LightProcessPool] = None
+_grep_executor_workers = 0
+_grep_executor_lock = threading.Lock()
+
+
+def get_text_store(path: str) -> TextStore:
+    """
+    TextStore файла (один на процесс)
+
+    При изменении файла (размер/mtime) открывается заново, индекс строк пересобирается.
+    """
+    key = os.path.realpath(path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None or not store.is_current():
+            store = _stores[key] = TextStore(key)
+        return store
+
+
+def get_grep_executor(workers: int) -> LightProcessPool:
+    """
+    Общий для процесса пул regex grep (создаётся при первом большом поиске)
+
+    Воркеры - отдельные процессы rag_process_pool (не наследуют потоки родителя и
+    не выполняют __main__ лаунчера). Сломанный пул (воркер умер) создаётся заново.
+    """
+    global _grep_executor, _grep_executor_workers
+    with _grep_executor_lock:
+        if _grep_executor is None or _grep_executor_workers != workers or _grep_executor.broken:
+            if _grep_executor is not None:
+                _grep_executor.shutdown(wait=False, cancel_futures=True)
+            _grep_executor = LightProcessPool(workers)
+            _grep_executor_workers = workers
+        return _grep_executor
+
+
+def _grep_regex_worker(path: str, version: Tuple[int, int], pattern: Pattern[str],
+                       start: int, end: int, max_lines: Optional[int]) -> List[int]:
+    store = get_text_store(path)
+    if store.version != version:
+        raise RuntimeError(f"Text file changed during grep: {path}")
+    return store._grep_regex_range(pattern, start, end, max_lines)
@@ -56,11 +56,7 @@ class AdvancedRAGInterface:
             # Проверка существования БД
             if os.path.exists(str(db_path)):
                 progress(0.4, desc="Загрузка существующей БД...")
-                from langchain_community.vectorstores import Chroma
-                self.rag.vectorstore = Chroma(
-                    persist_directory=str(db_path),
-                    embedding_function=self.rag.embeddings
-                )
+                self.rag.load_vectorstore()
                 status_msg = f"✅ База данных '{db_name}' загружена\n📁 Путь: {db_path}"
             else:
                 progress(0.4, desc="Чтение файла...")
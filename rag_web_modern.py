@@ -5,6 +5,8 @@ Modern RAG Interface 2025 - Glassmorphism + Particles
 
 import gradio as gr
 from rag_advanced_memory import AdvancedRAGMemory
+from rag_ingestion import format_location
+from rag_text_store import get_text_store, literal_pattern
 import os
 import subprocess
 import time
@@ -345,6 +347,18 @@ class ModernRAGInterface:
         self.DEFAULT_DB_PATH = self.project_dir / "chroma_db_kosmoenergy"
         self.DEFAULT_TEXT_FILE = str(self.project_dir / "cosmic_texts.txt")
         self.EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+        # "torch" - fp32 на GPU; на CPU-серверах "onnx-int8"/"int8"/"onnx" (та же база, быстрее запросы)
+        self.EMBEDDING_BACKEND = "torch"
+        # Потоки torch (None - авто) и число запросов, одновременно векторизуемых моделью
+        self.TORCH_THREADS = None
+        self.MAX_CONCURRENT_EMBEDDINGS = 1
+        # "chroma" - HNSW; "exact" - точный перебор по float16 матрице (детерминированный recall)
+        self.VECTOR_ENGINE = "chroma"
+        # ef_search HNSW для семантического поиска (None - настройка базы; см. hnsw_sweep.py)
+        self.SEMANTIC_EF_SEARCH = None
+        # Процессов для regex GREP по большому тексту (None - по числу ядер до 8, 0 - в текущем
+        # процессе); каждый воркер ~30 MB и ~0.5 с на запуск при первом большом поиске
+        self.GREP_WORKERS = 2
         self.rag = None
         self.is_initialized = False
         self.current_db_name = "Космоэнергетика"
@@ -418,16 +432,19 @@ class ModernRAGInterface:
                 max_context_tokens=max_context_tokens,
                 summarize_threshold=int(max_context_tokens * 0.7),
                 enable_auto_summarize=True,
-                use_gpu=True
+                use_gpu=True,
+                embedding_backend=self.EMBEDDING_BACKEND,
+                torch_threads=self.TORCH_THREADS,
+                max_concurrent_embeddings=self.MAX_CONCURRENT_EMBEDDINGS,
+                vector_engine=self.VECTOR_ENGINE
             )
 
             progress(0.3, desc="🧠 Загрузка embedding модели...")
 
-            from langchain_community.vectorstores import Chroma
-            self.rag.vectorstore = Chroma(
-                persist_directory=str(db_path),
-                embedding_function=self.rag.embeddings
-            )
+            self.rag.load_vectorstore()
+            if self.EMBEDDING_BACKEND != "torch":
+                # Векторы запросов должны совпадать с fp32 векторами базы
+                self.rag.verify_embedding_parity()
 
             progress(0.6, desc="🔗 Подключение LM Studio...")
             logger.info("Подключение к LM Studio...")
@@ -522,15 +539,18 @@ class ModernRAGInterface:
                 max_context_tokens=max_context_tokens,
                 summarize_threshold=int(max_context_tokens * 0.7),
                 enable_auto_summarize=True,
-                use_gpu=True
+                use_gpu=True,
+                embedding_backend=self.EMBEDDING_BACKEND,
+                torch_threads=self.TORCH_THREADS,
+                max_concurrent_embeddings=self.MAX_CONCURRENT_EMBEDDINGS,
+                vector_engine=self.VECTOR_ENGINE
             )
 
             progress(0.2, desc="🧠 Загрузка embedding модели...")
 
             if db_exists:
                 progress(0.4, desc="📚 Загрузка существующей базы...")
-                from langchain_community.vectorstores import Chroma
-                self.rag.vectorstore = Chroma(persist_directory=str(db_path), embedding_function=self.rag.embeddings)
+                self.rag.load_vectorstore()
                 status_msg = f"✅ База '{db_name}' загружена из кэша (мгновенно!)"
             else:
                 progress(0.4, desc="📖 Чтение файла...")
@@ -575,66 +595,64 @@ class ModernRAGInterface:
             return f"❌ Ошибка: {str(e)}"
 
     def grep_search(self, query: str, context_lines: int = 3, fuzzy: bool = True):
+        """Текстовый поиск с поддержкой нечёткого поиска (повтор к той же версии текста - из кэша)"""
+        # Ошибка (сломанный пул процессов, нехватка памяти, файл заменён во время чтения)
+        # ловится снаружи кэша: иначе до конца TTL она отдавалась бы как "ничего не найдено"
+        try:
+            if self.rag is None:
+                return self._grep_search(query, context_lines, fuzzy)
+            return self.rag.cached_result(
+                "grep_search", query, (context_lines, fuzzy),
+                lambda: self._grep_search(query, context_lines, fuzzy)
+            )
+        except Exception as e:
+            logger.error(f"GREP ошибка: {e}")
+            return []
+
+    def _grep_search(self, query: str, context_lines: int = 3, fuzzy: bool = True):
         """Текстовый поиск с поддержкой нечёткого поиска (fuzzy)"""
         import re
 
         results = []
-        try:
-            # Используем файл из RAG (тот который загружен)
-            text_file = self.rag.text_file_path if self.rag else self.DEFAULT_TEXT_FILE
-            logger.info(f"GREP ищет в файле: {text_file} (fuzzy={fuzzy})")
-
-            with open(text_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-
-            if fuzzy:
-                # Нечёткий поиск: допускаем пропуски пробелов внутри СЛОВ
-                # ВАЖНО: применяем fuzzy только к отдельным словам, не ко всему запросу!
-                # Иначе будет катастрофическая производительность на больших файлах
-
-                # Извлекаем ключевые слова (слова от 3+ символов)
-                stopwords = {'что', 'как', 'где', 'когда', 'зачем', 'почему', 'какой', 'какая', 'какие', 'для', 'работы', 'канал', 'частота'}
-                words = re.findall(r'\b[а-яёА-ЯЁ]{3,}\b', query.lower())
-                keywords = [w for w in words if w not in stopwords]
-
-                if not keywords:
-                    # Если нет ключевых слов, используем точный поиск
-                    pattern = re.compile(re.escape(query), re.IGNORECASE)
-                    logger.info(f"Fuzzy: ключевых слов не найдено, точный поиск: {query}")
-                else:
-                    # Создаём fuzzy паттерн для КАЖДОГО слова отдельно
-                    fuzzy_words = []
-                    for keyword in keywords[:3]:  # Берем максимум 3 ключевых слова
-                        chars = list(keyword)
-                        # Добавляем [\s\-]* между буквами (опциональные пробелы/дефисы)
-                        fuzzy_word = ''.join([re.escape(c) + r'[\s\-]*' for c in chars[:-1]]) + re.escape(chars[-1])
-                        fuzzy_words.append(fuzzy_word)
-
-                    # Объединяем все fuzzy слова через OR (|)
-                    fuzzy_pattern = '|'.join([f'\\b{fw}\\b' for fw in fuzzy_words])
-                    pattern = re.compile(fuzzy_pattern, re.IGNORECASE)
-                    logger.info(f"Fuzzy keywords: {keywords[:3]} → pattern length: {len(fuzzy_pattern)} chars")
+        # Используем файл из RAG (тот который загружен)
+        text_file = self.rag.text_file_path if self.rag else self.DEFAULT_TEXT_FILE
+        logger.info(f"GREP ищет в файле: {text_file} (fuzzy={fuzzy})")
+
+        # Текст отображён в память один раз на процесс, строки - по смещениям
+        store = get_text_store(text_file)
+
+        if fuzzy:
+            # Нечёткий поиск: допускаем пропуски пробелов внутри СЛОВ
+            # ВАЖНО: применяем fuzzy только к отдельным словам, не ко всему запросу!
+            # Иначе будет катастрофическая производительность на больших файлах
+
+            # Извлекаем ключевые слова (слова от 3+ символов)
+            stopwords = {'что', 'как', 'где', 'когда', 'зачем', 'почему', 'какой', 'какая', 'какие', 'для', 'работы', 'канал', 'частота'}
+            words = re.findall(r'\b[а-яёА-ЯЁ]{3,}\b', query.lower())
+            keywords = [w for w in words if w not in stopwords]
+
+            if not keywords:
+                # Если нет ключевых слов, используем точный поиск
+                line_numbers = store.grep(re.compile(literal_pattern(query)))
+                logger.info(f"Fuzzy: ключевых слов не найдено, точный поиск: {query}")
             else:
-                # Точный поиск
-                pattern = re.compile(query, re.IGNORECASE)
-
-            for i, line in enumerate(lines):
-                if pattern.search(line):
-                    # Берем контекст
-                    start = max(0, i - context_lines)
-                    end = min(len(lines), i + context_lines + 1)
-
-                    context = ''.join(lines[start:end])
-                    results.append({
-                        'line_num': i + 1,
-                        'context': context,
-                        'matched_line': line.strip()
-                    })
-
-            return results
-        except Exception as e:
-            logger.error(f"GREP ошибка: {e}")
-            return []
+                # КАЖДОЕ слово отдельно - подстрокой в теневой копии текста (без пробелов/дефисов,
+                # ё → е), границы слова проверяются только в найденных строках; максимум 3 слова
+                logger.info(f"Fuzzy keywords: {keywords[:3]}")
+                line_numbers = store.grep_fuzzy(keywords[:3])
+        else:
+            # Точный поиск (пользовательский regex) - построчно, диапазонами строк в пуле процессов
+            line_numbers = store.grep_regex(re.compile(query, re.IGNORECASE), workers=self.GREP_WORKERS)
+
+        for i in line_numbers:
+            # Берем контекст
+            results.append({
+                'line_num': i + 1,
+                'context': store.context(i, context_lines, context_lines),
+                'matched_line': store.line(i).strip()
+            })
+
+        return results
 
     def ask_question(self, question, temperature, max_tokens, num_sources, search_mode):
         logger.info(f"="*70)
@@ -738,7 +756,8 @@ class ModernRAGInterface:
                 search_kwargs = {
                     "k": num_sources,
                     "fetch_k": num_sources * 3,  # Больше кандидатов для fuzzy search
-                    "lambda_mult": 0.5
+                    "lambda_mult": 0.5,
+                    "ef_search": self.SEMANTIC_EF_SEARCH
                 }
                 logger.info(f"search_kwargs: {search_kwargs}")
                 self.rag.retriever.search_kwargs = search_kwargs
@@ -761,7 +780,8 @@ class ModernRAGInterface:
                 sources = ""
                 for i, doc in enumerate(result['source_documents'], 1):
                     content = doc.page_content[:400]
-                    sources += f"📄 Источник {i}\n{content}{'...' if len(doc.page_content) > 400 else ''}\n\n"
+                    location = format_location(doc.metadata)
+                    sources += f"📄 Источник {i}{f' ({location})' if location else ''}\n{content}{'...' if len(doc.page_content) > 400 else ''}\n\n"
 
                 stats = result['memory_stats']
                 memory_info = f"""💾 Память: {stats['short_memory_size']} недавних | {stats['long_memory_size']} суммаризированных
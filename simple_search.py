@@ -6,6 +6,11 @@ import re
 import sys
 from pathlib import Path
 
+from rag_text_store import get_text_store
+
+# Процессов для поиска по большому файлу (None - авто, 0 - в текущем процессе)
+GREP_WORKERS = None
+
 def search_text(query: str, text_file: str, context_lines: int = 5):
     """
     Поиск с контекстом (как grep -C)
@@ -15,23 +20,18 @@ def search_text(query: str, text_file: str, context_lines: int = 5):
         text_file: путь к файлу
         context_lines: сколько строк до и после показать
     """
-    with open(text_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+    # Файл отображается в память один раз, строки - по смещениям
+    store = get_text_store(text_file)
 
     results = []
     pattern = re.compile(query, re.IGNORECASE)
 
-    for i, line in enumerate(lines):
-        if pattern.search(line):
-            # Берем контекст
-            start = max(0, i - context_lines)
-            end = min(len(lines), i + context_lines + 1)
-
-            context = ''.join(lines[start:end])
-            results.append({
-                'line_num': i + 1,
-                'context': context
-            })
+    for i in store.grep_regex(pattern, workers=GREP_WORKERS):
+        # Берем контекст
+        results.append({
+            'line_num': i + 1,
+            'context': store.context(i, context_lines, context_lines)
+        })
 
     return results
 
@@ -0,0 +1,62 @@
+"""
+Проверка координат чанков: каждый span, прочитанный из файла по start_byte/end_byte,
+совпадает с текстом чанка, а start_line/end_line - строки его первого и последнего символа
+Короткие строки (чанки внутри перекрытия предыдущих) и переводы строк LF / CRLF / CR
+"""
+import os
+import random
+import sys
+import tempfile
+
+from rag_ingestion import iter_text_spans, read_source_span
+
+SEED = 1
+WORDS = ['а', 'бы', 'сон', 'Перун', 'x', 'да-да', 'ё', 'мир.', 'слово']
+NEWLINES = {'LF': ['\n'], 'CRLF': ['\r\n'], 'mixed': ['\n', '\r\n', '\n\n', '\r']}
+# (chunk_size, chunk_overlap, window_size)
+SETTINGS = [(60, 40, 3000), (100, 50, 5000), (200, 20, 100000)]
+
+
+def line_of(data: bytes, offset: int) -> int:
+    """Номер строки (с 1) байта offset - по нормализованному тексту до него"""
+    text = data[:offset].decode('utf-8', errors='replace')
+    return text.replace("\r\n", "\n").replace("\r", "\n").count("\n") + 1
+
+
+def check_file(path: str, chunk_size: int, chunk_overlap: int, window_size: int) -> int:
+    with open(path, 'rb') as f:
+        data = f.read()
+    bad = 0
+    spans = list(iter_text_spans(path, chunk_size, chunk_overlap, window_size))
+    for span in spans:
+        ok = read_source_span(path, span.start_byte, span.end_byte) == span.text
+        ok = ok and span.start_line == line_of(data, span.start_byte)
+        ok = ok and span.end_line == line_of(data, max(span.start_byte, span.end_byte - 1))
+        if not ok:
+            bad += 1
+            if bad <= 3:
+                print(f"  [-] {span.start_byte}-{span.end_byte} lines {span.start_line}-{span.end_line}: {span.text!r}")
+    print(f"  chunk_size={chunk_size}, overlap={chunk_overlap}: {len(spans)} chunks, {bad} wrong")
+    return bad
+
+
+rng = random.Random(SEED)
+lines = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 6))) for _ in range(6000)]
+
+print("=" * 70)
+print("TEXT SPAN ROUND-TRIP")
+print("=" * 70)
+
+total_bad = 0
+with tempfile.TemporaryDirectory() as tmp:
+    for name, newlines in NEWLINES.items():
+        path = os.path.join(tmp, f"spans_{name}.txt")
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(''.join(line + rng.choice(newlines) for line in lines))
+        print(f"\n{name}:")
+        for settings in SETTINGS:
+            total_bad += check_file(path, *settings)
+
+print()
+print("[+] All spans match" if not total_bad else f"[-] {total_bad} wrong spans")
+sys.exit(1 if total_bad else 0)